@@ -23,23 +23,126 @@
 __all__ = ["ModAnalysisError", "start"]
 
 import os
+import sys
 import shutil
 import subprocess
 import shlex
 import time
+import argparse
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from mod_graph import ModGraph, ModGraphError
 from mod_config import ModConfig, ModConfigError
+from mod_cache import ModCache
+from mod_archive import (open_entry, read_entry_head, list_zip_entry,
+                         test_archive, ModArchiveTimeout, no_prompt_args)
+from mod_fs import (scan_tree, file_crc, file_fingerprint, name_matcher,
+                    discover, discovery_key)
+from mod_iosched import ModIOScheduler
+from mod_spill import ModSpill
+from mod_shard import (ModIndexError, ModIndexWriter, read_indexes,
+                       shard_of)
+from mod_similarity import ModSimilarity
+from mod_history import (make_state, save_state, load_state, diff_states,
+                         iter_diff)
+from mod_stability import perturbed_orders, iter_stability_report
+from mod_progress import ModProgress
+from mod_snapshot import (ModSnapshotError, ModSnapshot, write_snapshot,
+                          iter_query)
+from mod_headers import (texture_extensions, texture_header_size,
+                         texture_quality, parse_texture_header,
+                         plugin_extensions, plugin_header_size,
+                         plugin_record_size, parse_plugin_masters,
+                         bsa_header_size, parse_bsa_header,
+                         parse_bsa_records)
 
 # Configuration file name
 ini_file = "%s.ini" % os.path.splitext(__file__)[0]
 # Archive compression types supported by 7z
 supported_archive_extensions = ['.7z', '.zip', '.rar']
+# Hashes of the files of unpacked mods are computed only if needed,
+# a placeholder starting with this prefix being used in the meantime.
+lazy_hash_prefix = '?'
 
 def start():
     """ """
-    mod_a = ModAnalysis()
-    mod_a.mod_analysis()
+    parser = argparse.ArgumentParser(
+            description="Morrowind Better Install Order")
+    parser.add_argument('-c', '--config', metavar='FILE', action='append',
+            help="configuration file (default: bio.ini). Given several "\
+                    "times, the archives are listed once, then the mods "\
+                    "are ordered for each configuration (profile) in "\
+                    "parallel processes")
+    parser.add_argument('--shard', metavar='I/N',
+            help="only list the archives of the shard I (1 <= I <= N) "\
+                    "of the library split by hash into N shards, "\
+                    "then write their index to the file given by --index")
+    parser.add_argument('--shard-dir', metavar='DIR',
+            help="only list the archives of this subdirectory of the "\
+                    "source directory, then write their index to the file "\
+                    "given by --index")
+    parser.add_argument('--index', metavar='FILE',
+            help="partial index file written by --shard or --shard-dir")
+    parser.add_argument('--merge', metavar='FILE', nargs='+',
+            help="order the mods of the given partial index files instead "\
+                    "of listing the archives")
+    parser.add_argument('--shards', metavar='N', type=int,
+            help="list the archives in N local worker processes")
+    parser.add_argument('--stability', metavar='RUNS', type=int, default=0,
+            help="order the mods again RUNS times with randomly perturbed "\
+                    "scores, then report how much the order varies")
+    parser.add_argument('--report', action='store_true',
+            help="write the reports and graphs again from the snapshot of "\
+                    "the last analysis, without analysing the mods again")
+    parser.add_argument('--query', metavar='NAME',
+            help="print the overlaps of a mod or of a data file from the "\
+                    "snapshot of the last analysis")
+    parser.add_argument('--snapshot', metavar='FILE',
+            help="snapshot used by --report and --query (default: the "\
+                    "one of the configuration file)")
+    parser.add_argument('--diff', metavar='STATE', nargs=2,
+            help="print the differences between two install order states "\
+                    "(order_state.json files saved by two runs)")
+    args = parser.parse_args()
+
+    if args.diff:
+        states = [load_state(filename) for filename in args.diff]
+        for filename, state in zip(args.diff, states):
+            if state is None:
+                raise ModAnalysisError("'%s' is not an install order state "\
+                        "saved by this version of BIO." % filename)
+        sys.stdout.writelines(iter_diff(diff_states(*states)))
+        return
+
+    config_files = args.config or [ini_file]
+    if len(config_files) > 1:
+        if args.shard or args.shard_dir or args.shards or args.stability:
+            parser.error("several configuration files can only be used "\
+                    "with --merge")
+        ModAnalysis(config_files[0]).order_profiles(config_files, args.merge)
+        return
+
+    mod_a = ModAnalysis(config_files[0])
+    mod_a.stability_runs = args.stability
+    if args.report or args.query:
+        mod_a.use_snapshot(args.snapshot, args.report, args.query)
+        return
+    if args.shard or args.shard_dir:
+        if not args.index:
+            parser.error("--index is required with --shard and --shard-dir")
+        shard = None
+        if args.shard:
+            try:
+                index, count = [int(i) for i in args.shard.split('/')]
+                assert 1 <= index <= count
+            except (ValueError, AssertionError):
+                parser.error("--shard expects I/N with 1 <= I <= N")
+            shard = (index - 1, count)
+        mod_a.write_shard(args.index, shard, args.shard_dir)
+    else:
+        mod_a.mod_analysis(args.merge, args.shards)
 
 
 class ModAnalysisError(Exception):
@@ -47,16 +150,87 @@ class ModAnalysisError(Exception):
         self.msg = msg
 
 
+def _list_shard(args):
+    """ Lists a shard of the library in a worker process. """
+    config_file, filename, shard = args
+    mod_a = ModAnalysis(config_file)
+    mod_a.shard_worker = True
+    mod_a.write_shard(filename, shard)
+    return mod_a.used_cache_entries()
+
+
+def _order_profile(args):
+    """ Orders the mods of a profile in a worker process. """
+    config_file, index_files = args
+    ModAnalysis(config_file).order_profile(index_files)
+
+
 class ModAnalysis(object):
 
     """ Analyses a list of Morrowind archive modules and
     produces an ordered installation list.
     """
 
-    def __init__(self):
+    # Caches filled while listing the mods
+    listing_caches = ('bsa_cache', 'plugin_cache', 'listing_cache',
+                      'fingerprint_cache', 'nested_cache')
+
+    def __init__(self, config_file=ini_file):
+        self.config_file = config_file
         self.mod_list = []
         self.datafile_list = {}
+        # Number of data files added, all versions included
+        self.datafile_count = 0
+        # External memory index used instead of datafile_list
+        # if a memory limit is configured.
+        self.spill = None
+        # Partial index written instead of analysing the listed mods
+        self.index_writer = None
+        # Only archives of this (shard, shard count) are listed
+        self.shard = None
+        # Set in worker processes, whose caches are saved by the parent
+        self.shard_worker = False
         self.overlapping_datafiles = {}
+        # Data files whose overlaps, added to the graph as the mods were
+        # listed, must be added again once listed, their versions having
+        # changed. None if overlaps are only added after the listing.
+        self.dirty_overlaps = None
+        # Texture quality of overlapping files: (mod, datafile) -> quality
+        self.datafile_quality = {}
+        # Plugins found in the archives: (mod, datafile, path, hash)
+        self.plugin_files = []
+        self.bsa_cache = None
+        self.plugin_cache = None
+        # Archive listings, by archive fingerprint. Not used if a memory
+        # limit is configured, as it is loaded in memory as a whole.
+        self.listing_cache = None
+        # Listings of nested archives, by (CRC, size)
+        self.nested_cache = None
+        self.cached_listings = 0
+        # Archive fingerprints, by (name without numerical prefix, size,
+        # mtime), so that renamed archives are not read again.
+        self.fingerprint_cache = None
+        # mod -> fingerprint of the archives listed or read
+        self.fingerprints = {}
+        # MinHash signatures of the mods, to find the superseded ones
+        self.similarity = None
+        # superseded mod -> (superseding mod, similarity)
+        self.superseded_mods = {}
+        self.duplicate_mods = []
+        # Mods left out of the graph and of the disk operations
+        self.excluded_mods = set()
+        # (data file, hash) -> versions of other mods which were not kept
+        # as having the same hash, used when excluding mods.
+        self.duplicate_versions = {}
+        # Number of runs of the stability analysis
+        self.stability_runs = 0
+        self.progress = None
+        # Pending integrity tests, and archives failing them:
+        # archive -> reason of the failure
+        self.verification = None
+        self.failed_archives = {}
+        # Mods of merged indexes missing from the source directory
+        self.missing_mods = []
         self.free_mod = []
         self.suspicious_files = {}
         self.mod_graph = None
@@ -70,25 +244,106 @@ class ModAnalysis(object):
         self.walk(_dir, self.process_archive)
 
     def walk(self, _dir, fun):
+        """ Applies fun on the archives and process_project on the unpacked
+        mods found in a directory, as they are discovered by a pool of
+        threads walking the directory tree. With the pipeline option, the
+        archives are listed ahead by threads scheduled per device, fun
+        being given their listings in the discovery order. """
         _dir = os.path.abspath(_dir)
-        for _file in os.listdir(_dir):
-            nfile = os.path.join(_dir, _file)
-            root, ext = os.path.splitext(_file)
-            if ext.lower() in supported_archive_extensions:
-                fun(nfile)
-            # Traverse through subdirectories only if there is an
-            # external directory for mods, ie. only if in copy mode.
-            elif os.path.isdir(nfile) and not self.cfg.rename:
-                if _file.lower() not in self.cfg.path['excluded_dirs']:
-                    self.walk(nfile, fun)
-
-    def process_archive(self, arcfile):
-        """ Extracts path, size and hash properties
-        of each file of an archive. """
+        self.progress.start('listing', 'archives')
+
+        def in_shard(nfile):
+            return self.shard is None or shard_of(
+                    nfile[len(self.cfg.path['src_dir']):],
+                    self.shard[1]) == self.shard[0]
+
+        def read(item):
+            """ Returns (file, is_project, listed, archive listing,
+            archive fingerprint, nested archive listings), listings being
+            read from the caches if possible. """
+            nfile, is_project = item
+            if not in_shard(nfile):
+                return nfile, is_project, False, None, None, None
+            if is_project:
+                return nfile, is_project, True, None, None, None
+            fingerprint = self.get_fingerprint(nfile)
+            listing = None
+            if self.listing_cache is not None:
+                listing = self.listing_cache.get(fingerprint)
+            if listing is None:
+                listing = self.list_archive(nfile)
+            nested = None
+            if self.cfg.option['nested_archives']:
+                nested = self.list_nested_archives(nfile, listing[0])
+            return nfile, is_project, True, listing, fingerprint, nested
+
+        # Traverse through subdirectories only if there is an
+        # external directory for mods, ie. only if in copy mode.
+        items = discover(
+                _dir,
+                supported_archive_extensions,
+                self.cfg.path['project_marker'],
+                not self.cfg.rename,
+                name_matcher(self.cfg.path['excluded_dirs']),
+                self.cfg.option['jobs'],
+                self.progress,
+                self.cfg.log)
+        if not self.cfg.option['pipeline']:
+            listings = itertools.imap(read, items)
+        else:
+            scheduler = ModIOScheduler(self.cfg.option['jobs'],
+                                       self.cfg.option['device_jobs'],
+                                       self.cfg.option['readahead'])
+            # Only the archives to list are scheduled by device
+            listings = scheduler.imap(read, items,
+                    lambda item: None if item[1] or not in_shard(item[0])
+                    else item[0])
+        for (nfile, is_project, listed, listing, fingerprint,
+                nested) in listings:
+            if not listed:
+                self.progress.update()
+            elif is_project:
+                self.process_project(nfile)
+            else:
+                fun(nfile, listing, fingerprint, nested)
+        self.progress.finish()
+        if self.cached_listings:
+            self.cfg.log("\t- Read %d archive listings from the cache." %
+                    self.cached_listings, False)
+        if self.cfg.option['pipeline']:
+            for dev, (slow, count) in sorted(scheduler.devices.items()):
+                self.cfg.log("\t- Listed %d archives of device %d (%s)." % (
+                    count, dev,
+                    'slow, %d at once' % scheduler.slow_jobs
+                    if slow else 'fast'),
+                    False)
+
+    def list_archive(self, arcfile):
+        """ Returns the listing of an archive: the (path, size, mtime, hash)
+        of its files, its number of entries and the size of the listing.
+        Only the archive is read, so that archives can be listed by several
+        threads at once. """
+        arccmd = '%s l -slt "%s"' % (self.cfg.path['archive'], arcfile)
+        arcargs = shlex.split(arccmd)
+        # Archives with encrypted headers would prompt for a password
+        arcargs[-1:-1] = no_prompt_args
+        with open(os.devnull, 'rb') as devnull:
+            arcproc = subprocess.Popen(arcargs, stdin=devnull,
+                                       stdout=subprocess.PIPE)
+        try:
+            return self.read_listing(arcproc.stdout, arcfile)
+        finally:
+            arcproc.stdout.close()
+            arcproc.wait()
+
+    def read_listing(self, arcout, arcfile):
+        """ Parses the technical listing of the archive 'arcfile' output by
+        the archive program on 'arcout', see list_archive. """
         def get_next_field(arcout, field, err):
             """ Returns the next field named 'field' from an input stream. """
             while 1:
                 line = arcout.readline()
+                parsed[0] += len(line)
                 if not line:
                     if err:
                         raise ModAnalysisError("Field '%s' not found." % field)
@@ -97,14 +352,10 @@ class ModAnalysis(object):
                 if line.startswith('%s = ' % field):
                     return line[len(field) + 3:].rstrip()
 
-        arcfile_node = arcfile[len(self.cfg.path['src_dir']):]
-        self.mod_list.append(arcfile_node)
-
-        arccmd = '%s l -slt "%s"' % (self.cfg.path['archive'], arcfile)
-        arcargs = shlex.split(arccmd)
-        arcproc = subprocess.Popen(arcargs, stdout=subprocess.PIPE)
-        arcout = arcproc.stdout
-        count = tsize = 0
+        files = []
+        entries = 0
+        # Bytes of listing read
+        parsed = [0]
 
         for i in range(0, 16):
             headers = arcout.readline()
@@ -112,35 +363,256 @@ class ModAnalysis(object):
                 raise ModAnalysisError("Archive headers of file '%s' ended"\
                         " prematurely." % arcfile)
         while 1:
-            filename = get_next_field(arcout, "Path", False).lower()
-            if not filename:
-                self.mod_graph.add_node(arcfile_node, count, tsize)
-                return
-            if filename.startswith("datafiles" + os.sep):
-                filename = filename[10:]
+            arcpath = get_next_field(arcout, "Path", False)
+            if not arcpath:
+                return files, entries, parsed[0]
+            entries += 1
             size = get_next_field(arcout, "Size", True)
             if size == '0':
                 continue
             mtime = get_next_field(arcout, "Modified", True)
-            tsize += int(size)
             fhash = get_next_field(arcout, "CRC", True)
-            if self.add_file(filename, size, mtime, fhash, arcfile_node):
+            files.append((arcpath, size, mtime, fhash))
+
+    def list_nested_archives(self, arcfile, files):
+        """ Returns the listings of the archives nested in an archive whose
+        listed files are 'files', as a dictionary: path of the nested
+        archive -> list of (path, size, mtime, hash), or None if it is not
+        a mere wrapper, ie. if it contains data files besides archives.
+        Nested archives are extracted in memory, never to the disk, which
+        only allows listing zip archives not larger than 'nested_max_size':
+        the archive program cannot list 7z or rar archives from a pipe.
+        Their listings are cached by (CRC, size). """
+        archives = [(arcpath, size, fhash) for arcpath, size, mtime, fhash
+                    in files if os.path.splitext(arcpath)[1].lower()
+                    in supported_archive_extensions]
+        if not archives or any(
+                os.path.splitext(arcpath)[1][1:].lower()
+                in self.cfg.path['expected_exts']
+                for arcpath, size, mtime, fhash in files):
+            return None
+        nested = {}
+        for arcpath, size, fhash in archives:
+            key = (fhash, int(size))
+            if key in self.nested_cache:
+                inner_files = self.nested_cache.get(key)
+            elif os.path.splitext(arcpath)[1].lower() == '.zip':
+                inner_files = list_zip_entry(
+                        self.cfg.path['archive'], arcfile, arcpath,
+                        self.cfg.option['nested_max_size'] * 2**20)
+                # Failures are not cached, they may depend on the
+                # maximum size or be transient.
+                if inner_files is not None:
+                    self.nested_cache.set(key, inner_files)
+            else:
+                inner_files = None
+            if inner_files is None:
+                self.cfg.log("Warning: Cannot list the archive '%s' nested "\
+                        "in '%s' (only zip archives of at most %d MB are "\
+                        "listed)." % (arcpath, arcfile,
+                                      self.cfg.option['nested_max_size']))
+            else:
+                nested[arcpath] = inner_files
+        return nested
+
+    def process_archive(self, arcfile, listing=None, fingerprint=None,
+                        nested=None):
+        """ Extracts path, size and hash properties of each file of an
+        archive, from its listing if it has already been read. Listings
+        are cached by archive fingerprint. The files of the archives
+        nested in it, listed in 'nested' (see list_nested_archives), take
+        the place of these archives. """
+        arcfile_node = arcfile[len(self.cfg.path['src_dir']):]
+        self.mod_list.append(arcfile_node)
+        if listing is None:
+            listing = self.list_archive(arcfile)
+        if fingerprint is not None:
+            self.fingerprints[arcfile_node] = fingerprint
+        if fingerprint is not None and self.listing_cache is not None:
+            if fingerprint in self.listing_cache:
+                self.cached_listings += 1
+            else:
+                self.listing_cache.set(fingerprint, listing)
+        files, entries, parsed = listing
+        count = tsize = 0
+        bsa_files = []
+
+        def iter_files():
+            """ Yields the (file, is nested) of the archive. """
+            for entry in files:
+                if nested and entry[0] in nested:
+                    for inner_entry in nested[entry[0]]:
+                        yield inner_entry, True
+                else:
+                    yield entry, False
+
+        for (arcpath, size, mtime, fhash), is_nested in iter_files():
+            filename = arcpath.lower()
+            if filename.startswith("datafiles" + os.sep):
+                filename = filename[10:]
+            tsize += int(size)
+            # Files of nested archives cannot be extracted
+            if self.add_file(filename, size, mtime, fhash, arcfile_node,
+                    None if is_nested else arcpath):
                 count +=1
+                if (filename.endswith('.bsa') and not is_nested and
+                        self.cfg.option['expand_bsa']):
+                    bsa_files.append((arcpath, mtime, fhash))
+
+        for bsa in bsa_files:
+            count += self.add_bsa_files(arcfile, arcfile_node, *bsa)
+        self.add_mod(arcfile_node, count, tsize)
+        self.progress.update(entries=entries, bytes=parsed)
+
+    def get_fingerprint(self, arcfile):
+        """ Returns the content fingerprint of an archive (see
+        file_fingerprint), which is kept when BIO or the user rename or
+        move the archive. It is only computed if the name of the archive
+        without numerical prefix, its size or its modification time are
+        not known yet. Can be called by several threads. """
+        st = os.stat(arcfile)
+        key = (self.cfg.clean_mod_num_prefix(arcfile).lower(), st.st_size,
+               st.st_mtime)
+        fingerprint = self.fingerprint_cache.get(key)
+        if fingerprint is None:
+            fingerprint = file_fingerprint(arcfile, st.st_size)
+            self.fingerprint_cache.set(key, fingerprint)
+        return fingerprint
+
+    def archive_key(self, mod):
+        """ Returns the key of the cached data of a mod: the fingerprint
+        of an archive, or the path of an unpacked mod. Returns None for
+        archives missing from the source directory, eg. those listed by
+        another host whose index has been merged. """
+        if mod not in self.fingerprints:
+            arcfile = '%s%s' % (self.cfg.path['src_dir'], mod)
+            if os.path.isdir(arcfile):
+                return mod
+            if not os.path.isfile(arcfile):
+                return None
+            self.fingerprints[mod] = self.get_fingerprint(arcfile)
+        return self.fingerprints[mod]
+
+    def process_project(self, projdir):
+        """ Extracts path, size and modification time properties of each
+        file of an unpacked mod directory. Only plugins and BSA archives
+        are hashed here, as they are read later on, the other files being
+        hashed only if they overlap with another mod. """
+        projdir_node = projdir[len(self.cfg.path['src_dir']):]
+        self.mod_list.append(projdir_node)
+        marker = self.cfg.path['project_marker']
+        count = tsize = 0
+        bsa_files = []
+
+        for arcpath, size, mtime in scan_tree(projdir, self.cfg.option['jobs']):
+            filename = arcpath.lower()
+            if filename == marker.lower() or size == 0:
+                continue
+            if filename.startswith("datafiles" + os.sep):
+                filename = filename[10:]
+            mtime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(mtime))
+            tsize += size
+            extension = os.path.splitext(filename)[1][1:]
+            # Files of shards may be hashed on another host only
+            if (extension in plugin_extensions or extension == 'bsa' or
+                    self.index_writer is not None):
+                fhash = file_crc(os.path.join(projdir, arcpath))
+            else:
+                fhash = '%s%s' % (lazy_hash_prefix, projdir_node)
+            if self.add_file(filename, size, mtime, fhash, projdir_node,
+                    arcpath):
+                count += 1
+                if extension == 'bsa' and self.cfg.option['expand_bsa']:
+                    bsa_files.append((arcpath, mtime, fhash))
+
+        for bsa in bsa_files:
+            count += self.add_bsa_files(projdir, projdir_node, *bsa)
+        self.add_mod(projdir_node, count, tsize)
+        self.progress.update(entries=count)
+
+    def read_bsa_files(self, arcfile, arcpath, fhash):
+        """ Returns the (path, size, offset) of the files contained in a BSA
+        archive, only its header and file records being streamed out of the
+        mod archive. Tables are cached by BSA CRC, failures not being cached
+        as they may be transient or due to the mod archive. """
+        if fhash in self.bsa_cache:
+            return self.bsa_cache.get(fhash)
+        files = None
+        with open_entry(self.cfg.path['archive'], arcfile, arcpath) as stream:
+            header = parse_bsa_header(stream.read(bsa_header_size))
+            if header is not None:
+                hash_offset, file_count = header
+                files = parse_bsa_records(stream.read(hash_offset),
+                                          file_count)
+        if files is None:
+            self.cfg.log("Warning: Cannot read the BSA archive '%s' of '%s'."
+                    % (arcpath, arcfile))
+        else:
+            self.bsa_cache.set(fhash, files)
+        return files
+
+    def add_bsa_files(self, arcfile, mod, arcpath, mtime, fhash):
+        """ Adds the files contained in a BSA archive as virtual data files
+        of the mod. Returns the number of added files. """
+        count = 0
+        for path, size, offset in self.read_bsa_files(
+                arcfile, arcpath, fhash) or ():
+            # BSA archives store no CRC: the same BSA file in two mods gives
+            # the same virtual hashes, any other BSA gives different ones.
+            bsa_hash = '%s:%d' % (fhash, offset)
+            if self.add_file(path.replace('\\', os.sep), size, mtime,
+                    bsa_hash, mod):
+                count += 1
+        return count
+
+    def add_mod(self, mod, file_count, size):
+        """ Adds a listed mod to the graph, or to the partial index. """
+        if self.index_writer is not None:
+            self.index_writer.add_mod(mod, file_count, size)
+        else:
+            self.mod_graph.add_node(mod, file_count, size)
+            if self.similarity is not None:
+                self.similarity.add_mod(mod)
 
-    def add_file(self, datafile, size, mtime, fhash, mod):
+    def add_file(self, datafile, size, mtime, fhash, mod, arcpath=None):
         """ Adds a data file to the dictionary.
-        Values are dictionaries: hash -> (size, archive file name) """
+        Values are dictionaries:
+        hash -> (archive file name, size, mtime, path in the archive) """
         first_mod_dir = datafile.partition(os.sep)[0]
         if first_mod_dir in self.cfg.path['excluded_arc_dirs']:
             return False
 
-        if datafile not in self.datafile_list:
-            self.datafile_list[datafile] = {}
-        versions = self.datafile_list[datafile]
-        if fhash not in versions:
-            versions[fhash] = (mod, int(size), mtime)
-
+        self.datafile_count += 1
         extension = os.path.splitext(datafile)[1][1:]
+        if self.index_writer is not None:
+            self.index_writer.add_file(datafile, int(size), mtime, fhash, mod,
+                                       arcpath)
+            if extension in plugin_extensions:
+                self.plugin_files.append((mod, datafile, arcpath, fhash))
+            return True
+        elif self.spill is not None:
+            self.spill.add(datafile, fhash, mod, int(size), mtime, arcpath)
+        else:
+            if datafile not in self.datafile_list:
+                self.datafile_list[datafile] = {}
+            versions = self.datafile_list[datafile]
+            if fhash not in versions:
+                versions[fhash] = (mod, int(size), mtime, arcpath)
+                if len(versions) > 1 and self.dirty_overlaps is not None:
+                    self.add_overlaps(datafile, versions, fhash)
+            elif (self.cfg.option['exclude_superseded'] and
+                    versions[fhash][0] != mod):
+                self.duplicate_versions.setdefault(
+                        (datafile, fhash), []).append(
+                                (mod, int(size), mtime, arcpath))
+
+        if self.similarity is not None:
+            # Files of unpacked mods are not hashed yet
+            self.similarity.add_file(mod, datafile,
+                    size if fhash.startswith(lazy_hash_prefix) else fhash,
+                    mtime)
+        if extension in plugin_extensions:
+            self.plugin_files.append((mod, datafile, arcpath, fhash))
         if extension.lower() not in self.cfg.path['expected_exts']:
             if mod not in self.suspicious_files:
                 self.suspicious_files[mod] = []
@@ -148,16 +620,61 @@ class ModAnalysis(object):
 
         return True
 
+    def add_overlaps(self, datafile, versions, fhash):
+        """ Adds the overlaps of the new version 'fhash' of a data file
+        to the graph, as soon as it is listed. """
+        self.overlapping_datafiles[datafile] = versions
+        mod, size, mtime = versions[fhash][:3]
+        for other_hash, other in versions.iteritems():
+            if other_hash == fhash:
+                continue
+            if other[0] == mod:
+                # Several versions in a mod: the one kept in the edges
+                # depends on the final versions.
+                self.dirty_overlaps.add(datafile)
+                continue
+            self.mod_graph.add_edge_datafile(mod, other[0], datafile,
+                    (size, other[1]), (mtime, other[2]))
+            self.mod_graph.add_edge_datafile(other[0], mod, datafile,
+                    (other[1], size), (other[2], mtime))
+
+    def unlink_overlaps(self, datafile, versions):
+        """ Removes the overlaps of a data file added to the graph as it was
+        listed, before its versions change. They are added again by
+        overlapping_datafiles_to_graph. """
+        if self.dirty_overlaps is None:
+            return
+        mods = set(props[0] for props in versions.itervalues())
+        for mod1 in mods:
+            for mod2 in mods:
+                if mod1 != mod2:
+                    self.mod_graph.del_edge_datafile(mod1, mod2, datafile)
+        self.dirty_overlaps.add(datafile)
+
     def overlapping_datafiles_to_graph(self):
         """ Organizes overlapping archive data files into
-        a graph of overlapping mods. """
-        for datafile in self.overlapping_datafiles:
+        a graph of overlapping mods. If the overlaps have been added as the
+        mods were listed, only the data files whose versions have changed
+        since or whose texture qualities are known are added again. """
+        datafiles = self.overlapping_datafiles
+        if self.dirty_overlaps is not None:
+            self.dirty_overlaps.update(datafile for _, datafile
+                                       in self.datafile_quality)
+            datafiles = [datafile for datafile in self.dirty_overlaps
+                         if datafile in self.overlapping_datafiles]
+        self.progress.start('overlaps', 'files', len(datafiles))
+        for datafile in datafiles:
             file_props = self.overlapping_datafiles[datafile]
+            self.progress.update(pairs=len(file_props) *
+                                 (len(file_props) - 1))
             for version in file_props:
                 mod1 = file_props[version][0]
                 for other_version in file_props:
                     mod2 = file_props[other_version][0]
                     if mod1 != mod2:
+                        qualities = (
+                                self.datafile_quality.get((mod1, datafile)),
+                                self.datafile_quality.get((mod2, datafile)))
                         self.mod_graph.add_edge_datafile(
                                 mod1,
                                 mod2,
@@ -165,24 +682,280 @@ class ModAnalysis(object):
                                 (file_props[version][1],
                                     file_props[other_version][1]),
                                 (file_props[version][2],
-                                    file_props[other_version][2])
+                                    file_props[other_version][2]),
+                                qualities if None not in qualities else None
                                 )
+        self.progress.finish()
         self.mod_graph.del_isolated_nodes()
 
     def set_overlapping_datafiles(self):
         """ Filters data files and keep those
         which overlap with another archive. """
-        self.overlapping_datafiles = dict(
-            (k,v)
-            for k,v in self.datafile_list.items() if len(v) > 1)
+        if self.spill is not None:
+            self.overlapping_datafiles = dict(
+                    self.spill.iter_overlapping(self.excluded_mods))
+            self.spill.close()
+        else:
+            # Already known if found as the mods were listed
+            if self.dirty_overlaps is None:
+                self.overlapping_datafiles = dict(
+                    (k,v)
+                    for k,v in self.datafile_list.items() if len(v) > 1)
+            if self.excluded_mods:
+                self.exclude_mod_versions()
+        self.resolve_lazy_hashes()
+
+    def exclude_mod_versions(self):
+        """ Removes the versions of the excluded mods from the overlapping
+        data files, a version of the same file from another mod taking
+        their place if there is one. """
+        for datafile, versions in self.overlapping_datafiles.items():
+            for fhash, props in versions.items():
+                if props[0] not in self.excluded_mods:
+                    continue
+                self.unlink_overlaps(datafile, versions)
+                del versions[fhash]
+                for other in self.duplicate_versions.get((datafile, fhash),
+                                                         []):
+                    if other[0] not in self.excluded_mods:
+                        versions[fhash] = other
+                        break
+            if len(versions) < 2:
+                del self.overlapping_datafiles[datafile]
+        self.duplicate_versions = {}
+
+    def set_superseded_mods(self):
+        """ Finds the near-duplicate mods, the older ones being superseded
+        by the newer ones, and excludes the superseded mods if required. """
+        self.superseded_mods, self.duplicate_mods = (
+                self.similarity.superseded())
+        self.cfg.log("\t- Found %d superseded and %d duplicate module "\
+                "archives." % (len(self.superseded_mods),
+                    len(self.duplicate_mods)))
+        if self.cfg.option['exclude_superseded']:
+            self.excluded_mods = set(self.superseded_mods)
+
+    def resolve_lazy_hashes(self):
+        """ Hashes the files of unpacked mods which may overlap with other
+        mods, then only keeps the data files which still have more than one
+        version. Files which cannot be read are dropped from the versions. """
+        lazy_files = []
+        for datafile, versions in self.overlapping_datafiles.iteritems():
+            for fhash, (mod, size, mtime, arcpath) in versions.iteritems():
+                if fhash.startswith(lazy_hash_prefix):
+                    lazy_files.append((datafile, versions, fhash, os.path.join(
+                        self.cfg.path['src_dir'], mod, arcpath)))
+        if not lazy_files:
+            return
+
+        def crc(path):
+            try:
+                return file_crc(path)
+            except IOError:
+                return None
+
+        pool = ThreadPool(self.cfg.option['jobs'])
+        hashes = pool.map(crc, [path for _, _, _, path in lazy_files])
+        pool.close()
+        pool.join()
+
+        for (datafile, versions, lazy_hash, path), fhash in zip(lazy_files,
+                                                                hashes):
+            self.unlink_overlaps(datafile, versions)
+            props = versions.pop(lazy_hash)
+            if fhash is None:
+                self.cfg.log("Warning: Cannot read '%s', left out of the "\
+                        "analysis." % path)
+            elif fhash not in versions:
+                versions[fhash] = props
+            if len(versions) < 2:
+                self.overlapping_datafiles.pop(datafile, None)
+
+    def inspect_textures(self):
+        """ Reads the header of every overlapping texture, extracting only
+        its first bytes, to get its resolution and mipmap count.
+        Headers are cached by (archive fingerprint, path, CRC). """
+        cache = ModCache(os.path.join(self.cfg.path['cache_dir'],
+                                      'textures.cache'))
+        jobs = {}
+        for datafile, versions in self.overlapping_datafiles.iteritems():
+            extension = os.path.splitext(datafile)[1][1:]
+            if extension not in texture_extensions:
+                continue
+            for fhash, (mod, size, mtime, arcpath) in versions.iteritems():
+                # Files contained in BSA archives cannot be extracted
+                if arcpath is None:
+                    continue
+                archive_key = self.archive_key(mod)
+                if archive_key is None:
+                    continue
+                key = (archive_key, arcpath, fhash)
+                if key in cache:
+                    self.datafile_quality[(mod, datafile)] = texture_quality(
+                            cache.get(key))
+                else:
+                    jobs.setdefault(mod, []).append(
+                            (datafile, extension, key))
+
+        def read_headers(mod):
+            arcfile = '%s%s' % (self.cfg.path['src_dir'], mod)
+            headers = []
+            for datafile, extension, key in jobs[mod]:
+                data = read_entry_head(self.cfg.path['archive'], arcfile,
+                                       key[1], texture_header_size)
+                headers.append((datafile, key,
+                                parse_texture_header(extension, data)))
+            return mod, headers
+
+        if jobs:
+            pool = ThreadPool(self.cfg.option['jobs'])
+            for mod, headers in pool.imap_unordered(read_headers, jobs):
+                for datafile, key, header in headers:
+                    cache.set(key, header)
+                    self.datafile_quality[(mod, datafile)] = texture_quality(
+                            header)
+            pool.close()
+            pool.join()
+        cache.save()
+        self.cfg.log("\t- Inspected %d overlapping textures (%d read from "\
+                "archives)." % (len(self.datafile_quality),
+                    sum(len(files) for files in jobs.itervalues())), False)
+
+    def read_plugin_masters(self):
+        """ Reads the TES3 header record of every plugin found in the
+        archives whose master list is not cached yet. Master lists are
+        cached by plugin CRC. Returns the number of plugins read. """
+        cache = self.plugin_cache
+        jobs = {}
+        for mod, datafile, arcpath, fhash in self.plugin_files:
+            # Plugins of nested archives cannot be extracted
+            if fhash not in cache and arcpath is not None:
+                jobs.setdefault(mod, []).append((arcpath, fhash))
+
+        def read_masters(mod):
+            arcfile = '%s%s' % (self.cfg.path['src_dir'], mod)
+            masters = []
+            for arcpath, fhash in jobs[mod]:
+                data = read_entry_head(self.cfg.path['archive'], arcfile,
+                                       arcpath, plugin_header_size)
+                record_size = plugin_record_size(data)
+                if record_size and record_size > len(data):
+                    data = read_entry_head(self.cfg.path['archive'], arcfile,
+                                           arcpath, record_size)
+                masters.append((fhash, parse_plugin_masters(data)))
+            return masters
+
+        if jobs:
+            pool = ThreadPool(self.cfg.option['jobs'])
+            for masters in pool.imap_unordered(read_masters, jobs):
+                for fhash, plugin_masters in masters:
+                    cache.set(fhash, plugin_masters)
+            pool.close()
+            pool.join()
+        if not self.shard_worker:
+            cache.save()
+        return sum(len(files) for files in jobs.itervalues())
+
+    def set_plugin_masters(self):
+        """ Forces the precedence of a mod over the mods providing the
+        masters of its plugins, as a [mod_precedences] entry would do. """
+        read_count = self.read_plugin_masters()
+        providers = {}
+        for mod, datafile, arcpath, fhash in self.plugin_files:
+            providers.setdefault(os.path.basename(datafile), set()).add(mod)
+
+        count = 0
+        for mod, datafile, arcpath, fhash in self.plugin_files:
+            for master in self.plugin_cache.get(fhash) or []:
+                for provider in providers.get(master, ()):
+                    # Entries of the configuration file prevail
+                    if (provider == mod or
+                            self.cfg.is_greater(mod, provider) != 0):
+                        continue
+                    self.cfg.add_precedence(mod, provider)
+                    count += 1
+        self.cfg.log("\t- Found %d plugin master dependencies between "\
+                "module archives (%d plugins read from archives)." % (
+                    count, read_count), False)
+
+    def start_verification(self):
+        """ Starts testing the integrity of the listed archives in the
+        background, the archives already tested, even under another name,
+        being skipped, as well as the archives missing from the source
+        directory. """
+        cache = ModCache(os.path.join(self.cfg.path['cache_dir'],
+                                      'verify.cache'))
+        jobs = []
+        for mod in self.mod_list:
+            arcfile = '%s%s' % (self.cfg.path['src_dir'], mod)
+            if os.path.isdir(arcfile):
+                continue
+            key = self.archive_key(mod)
+            if key is not None and key not in cache:
+                jobs.append((key, arcfile))
+        pool = ThreadPool(self.cfg.option['jobs'])
+
+        def test(job):
+            """ Returns (key, failure, whether the test has completed). """
+            key, arcfile = job
+            try:
+                return key, test_archive(self.cfg.path['archive'], arcfile,
+                        self.cfg.option['verify_timeout']), True
+            except ModArchiveTimeout as e:
+                return key, e.msg, False
+        self.verification = (cache, pool, pool.map_async(test, jobs))
+        pool.close()
+
+    def finish_verification(self):
+        """ Waits for the integrity tests, and logs the failed archives. """
+        tstart = time.time()
+        cache, pool, results = self.verification
+        tested = results.get()
+        pool.join()
+        # Stopped tests are not cached, the archives being tested again by
+        # the next run, and do not count as failures.
+        stopped = {}
+        for key, failure, completed in tested:
+            if completed:
+                cache.set(key, failure)
+            else:
+                stopped[key] = failure
+        cache.save()
+        for mod in self.mod_list:
+            arcfile = '%s%s' % (self.cfg.path['src_dir'], mod)
+            if os.path.isdir(arcfile):
+                continue
+            key = self.archive_key(mod)
+            if key in stopped:
+                self.cfg.log("Warning: The integrity of '%s' is unknown: "\
+                        "%s" % (mod, stopped[key]))
+                continue
+            failure = cache.get(key)
+            if failure:
+                self.failed_archives[mod] = failure
+        self.cfg.log("\t- Tested %d new archives (waited %.2fs), %d "\
+                "archives failed the integrity test." % (
+                    len(tested), time.time() - tstart,
+                    len(self.failed_archives)))
 
     def set_free_mod(self):
         """ Calculates the list of non overlapping archives. """
         self.free_mod = [mod for mod in self.mod_list
-                         if mod not in self.ordered_overlap_mod]
+                         if mod not in self.ordered_overlap_mod and
+                         mod not in self.excluded_mods]
 
     def prepare_disk_operations(self):
+        # Mods listed by other hosts whose index has been merged may be
+        # missing here, they are left out of the disk operations.
+        src_dir = self.cfg.path['src_dir']
+        self.missing_mods = sorted(
+                mod for mod in set(self.free_mod) |
+                set(self.ordered_overlap_mod)
+                if not os.path.exists('%s%s' % (src_dir, mod)))
+        missing = set(self.missing_mods)
         for mod in sorted(self.free_mod):
+            if mod in self.failed_archives or mod in missing:
+                continue
             clean_name = self.cfg.clean_mod_num_prefix(mod)
             new_name = clean_name
             old_name = mod
@@ -190,6 +963,8 @@ class ModAnalysis(object):
                 self.disk_operations.append((old_name, new_name))
 
         for i, mod in enumerate(self.ordered_overlap_mod):
+            if mod in self.failed_archives or mod in missing:
+                continue
             clean_name = self.cfg.clean_mod_num_prefix(mod)
             new_name = "%03d0-%s" % (
                     i + 1,
@@ -208,49 +983,128 @@ class ModAnalysis(object):
             if os.path.exists(tgt):
                 self.overwritten_mods.append(tgt)
 
+    def iter_suspicious(self):
+        """ Generates the content of the suspicious files report. """
+        for mod in sorted(self.suspicious_files.iterkeys()):
+            yield '%s :\n' % mod
+            for datafile in self.suspicious_files[mod]:
+                yield '\t%s\n' % datafile
+
+    def write_stability(self, ratios_graph):
+        """ Orders the mods again with randomly perturbed scores, and
+        reports how the positions of the mods and the overlaps vary. """
+        tstart = time.time()
+        results = perturbed_orders(ratios_graph, self.stability_runs,
+                                   self.cfg.option['jobs'])
+        edges = [(mod1, mod2, edge.score)
+                 for mod1, mods in self.mod_graph.mod_edges.iteritems()
+                 for mod2, edge in mods.iteritems() if not edge.removed]
+        with open(self.cfg.path['stability'], 'w') as stability:
+            stability.writelines(iter_stability_report(
+                self.ordered_overlap_mod, edges, results,
+                self.cfg.option['stability_sigma'],
+                self.cfg.clean_mod_num_prefix))
+        self.cfg.log("\t- Stability analysis: %d runs in %.2fs, see '%s'." % (
+            self.stability_runs, time.time() - tstart,
+            self.cfg.path['stability']))
+
+    def iter_similar(self):
+        """ Generates the content of the similar mods report. """
+        newest = self.similarity.newest_mtime
+        if self.superseded_mods:
+            yield 'Superseded mod archives%s:\n\n' % (
+                    ' (left out of the analysis)'
+                    if self.cfg.option['exclude_superseded'] else '')
+            for mod in sorted(self.superseded_mods):
+                new, similarity = self.superseded_mods[mod]
+                yield '%s (%s)\n\tby %s (%s), similarity %.2f\n' % (
+                        mod, newest(mod), new, newest(new), similarity)
+            yield '\n'
+        if self.duplicate_mods:
+            yield 'Duplicate mod archives:\n\n'
+            for mod1, mod2, similarity in self.duplicate_mods:
+                yield '%s\n\t%s, similarity %.2f\n' % (mod1, mod2,
+                                                        similarity)
+
+    def iter_disk_operations(self):
+        """ Generates the content of the disk operations report. """
+        tgt_dir = self.cfg.path['tgt_dir']
+        src_dir = self.cfg.path['src_dir']
+
+        if self.failed_archives:
+            yield 'ERROR: The following mod archives failed the integrity '\
+                    'test, they will be left untouched:\n\n'
+            for mod in sorted(self.failed_archives):
+                yield '%s\n    %s\n' % (mod, self.failed_archives[mod])
+            yield "\n"
+
+        if self.missing_mods:
+            yield 'WARNING: The following mods were not found in the source '\
+                    'directory, they will be left out:\n\n'
+            for mod in self.missing_mods:
+                yield '%s\n' % mod
+            yield "\n"
+
+        if len(self.overwritten_mods) > 0:
+            if self.cfg.rename:
+                yield 'ERROR: The following mod archives will be '\
+                        'lost during the process:\n\n'
+            else:
+                yield 'WARNING: The following mod archives will be '\
+                        'overwritten during the process:\n\n'
+            for file_path in self.overwritten_mods:
+                yield '%s\n' % file_path
+            yield "\n"
+
+        yield 'Your mod archives will be '
+        t = " " * 4
+        if self.cfg.rename:
+            yield 'renamed '
+        else:
+            yield 'copied from\n%s%s%s\nto\n%s%s\n' % (
+                    t, src_dir, t, t, tgt_dir)
+        yield 'as follow:\n\n'
+
+        for old_name, new_name in self.disk_operations:
+            yield '%s%s->%s%s\n' % (old_name, t, t, new_name)
+
     def write_info_files(self):
         if self.suspicious_files:
             with open('%s' % self.cfg.path['suspicious'],
                     'w') as suspicious:
-                for mod in sorted(self.suspicious_files.iterkeys()):
-                    buff = ['%s :\n' % mod]
-                    for datafile in self.suspicious_files[mod]:
-                        buff.append('\t%s\n' % datafile)
-                    suspicious.write(''.join(buff))
+                suspicious.writelines(self.iter_suspicious())
+
+        if self.superseded_mods or self.duplicate_mods:
+            with open('%s' % self.cfg.path['similar'], 'w') as similar:
+                similar.writelines(self.iter_similar())
 
         with open('%s' % self.cfg.path['disk_operations'],
                 'w') as disk_operations:
-            buff = ['']
-            tgt_dir = self.cfg.path['tgt_dir']
-            src_dir = self.cfg.path['src_dir']
-
-            if len(self.overwritten_mods) > 0:
-                if self.cfg.rename:
-                    buff.append('ERROR: The following mod archives will be '\
-                            'lost during the process:\n\n')
-                else:
-                    buff.append('WARNING: The following mod archives will be '\
-                            'overwritten during the process:\n\n')
-                for file_path in self.overwritten_mods:
-                    buff.append('%s\n' % file_path)
-                buff.append("\n")
-
-            buff.append('Your mod archives will be ')
-            t = " " * 4
-            if self.cfg.rename:
-                buff.append('renamed ')
-            else:
-                buff.append('copied from\n%s%s%s\nto\n%s%s\n'
-                        % (t, src_dir, t, t, tgt_dir))
-            buff.append('as follow:\n\n')
-
-            for old_name, new_name in self.disk_operations:
-                buff.append('%s%s->%s%s\n' % (old_name, t, t, new_name))
-
-            disk_operations.write(''.join(buff))
+            disk_operations.writelines(self.iter_disk_operations())
 
         self.mod_graph.write_graph_files(self.cfg.path['overlaps'])
 
+    def write_order_diff(self):
+        """ Saves the state of the install order, and writes its differences
+        with the state saved by the previous run. """
+        edges = sorted((mod1, mod2, edge.score)
+                       for mod1, mods in self.mod_graph.mod_edges.iteritems()
+                       for mod2, edge in mods.iteritems())
+        discarded = [(mod1, mod2, edge.score)
+                     for mod1, mod2, edge in self.mod_graph.FAS]
+        state = make_state(self.ordered_overlap_mod, edges, discarded,
+                           self.cfg.clean_mod_num_prefix)
+        previous = load_state(self.cfg.path['order_state'])
+        if previous is not None:
+            diff = diff_states(previous, state)
+            with open(self.cfg.path['order_diff'], 'w') as order_diff:
+                order_diff.writelines(iter_diff(diff))
+            self.cfg.log("\t- Since the previous run: %d mods moved, %d "\
+                    "overlaps flipped, %d overlaps newly discarded." % (
+                        len(diff['moved']), len(diff['flipped']),
+                        len(diff['discarded'])))
+        save_state(self.cfg.path['order_state'], state)
+
     def copy_rename_mods(self):
         """ Rename the mods with a prefix number. If there is a external
         (source) directory for mods, then copy/rename the mods to the
@@ -295,8 +1149,13 @@ class ModAnalysis(object):
         if 'dot' in self.cfg.path:
             self.cfg.log(
                     "\nYou can get a visual representation of mod precedence"\
-                    "by opening the file '%s.pdf'"\
+                    " by opening the file(s) '%s*.pdf'"\
                     % self.cfg.path['overlaps'])
+        if self.missing_mods:
+            self.cfg.log("\nWARNING: %d mods were not found in the source "\
+                    "directory and will be left out, see '%s'." % (
+                        len(self.missing_mods),
+                        self.cfg.path['disk_operations']))
 
         self.cfg.log("\nType 'yes' + Enter to start disk operations.")
         try:
@@ -319,53 +1178,325 @@ class ModAnalysis(object):
             else:
                 if self.cfg.rename:
                     shutil.move(src, tgt)
+                elif os.path.isdir(src):
+                    # Overwritten like archives, a previous copy being
+                    # replaced by the current one.
+                    if os.path.isdir(tgt):
+                        shutil.rmtree(tgt)
+                    elif os.path.exists(tgt):
+                        os.remove(tgt)
+                    shutil.copytree(src, tgt)
                 else:
                     shutil.copy(src, tgt)
 
         self.cfg.log('\nOperations done!')
 
-    def mod_analysis(self):
+    def use_snapshot(self, filename=None, report=False, query=None):
+        """ Writes the reports and graphs again, and/or answers a query,
+        from the snapshot of a previous analysis. """
         tstart = time.time()
-        self.cfg = ModConfig(ini_file)
+        self.cfg = ModConfig(self.config_file)
+        snapshot = ModSnapshot(filename or self.cfg.path['snapshot'])
+        try:
+            if query:
+                sys.stdout.writelines(iter_query(
+                    snapshot, query, self.cfg.clean_mod_num_prefix))
+            if report:
+                self.mod_graph = snapshot.to_graph(self.cfg)
+                self.mod_graph.write_graph_files(self.cfg.path['overlaps'])
+                self.cfg.log("\t- Reports written from the snapshot in "\
+                        "%.2fs" % (time.time() - tstart))
+        finally:
+            snapshot.close()
+            self.cfg.log_fd.close()
+
+    def init_analysis(self):
+        """ Loads the configuration and the caches. """
+        self.cfg = ModConfig(self.config_file)
+        self.mod_graph = ModGraph(self.cfg)
+        self.bsa_cache = ModCache(os.path.join(self.cfg.path['cache_dir'],
+                                               'bsa.cache'))
+        self.plugin_cache = ModCache(os.path.join(self.cfg.path['cache_dir'],
+                                                  'plugins.cache'))
+        if not self.cfg.option['memory_limit']:
+            self.listing_cache = ModCache(os.path.join(
+                self.cfg.path['cache_dir'], 'listings.cache'))
+        self.fingerprint_cache = ModCache(os.path.join(
+            self.cfg.path['cache_dir'], 'fingerprints.cache'))
+        self.nested_cache = ModCache(os.path.join(
+            self.cfg.path['cache_dir'], 'nested.cache'))
+        self.progress = ModProgress(self.cfg.option['progress'],
+                                    self.cfg.option['progress_file'],
+                                    self.cfg.option['progress_interval'])
+        self.mod_graph.progress = self.progress
+        if self.cfg.option['similarity_threshold'] > 0:
+            self.similarity = ModSimilarity(
+                    self.cfg.option['similarity_threshold'])
+
+    def init_index(self):
+        """ Creates the index of the data files, unless a partial index is
+        written: on disk if a memory limit is configured, else in memory,
+        the overlaps being then added to the graph as the mods are listed
+        with the pipeline option. """
+        if self.index_writer is not None:
+            return
+        if self.cfg.option['memory_limit']:
+            self.spill = ModSpill(self.cfg.option['memory_limit'],
+                                  self.cfg.path['cache_dir'])
+        elif self.cfg.option['pipeline']:
+            self.dirty_overlaps = set()
+
+    def list_mods(self, directory=None):
+        """ Lists the archives and unpacked mods of the source directory,
+        or only those of one of its subdirectories. """
+        self.init_index()
+        self.traverse_archives(directory or self.cfg.path['src_dir'])
+        if not self.shard_worker:
+            self.save_caches(directory is None and self.shard is None)
 
+    def save_caches(self, listed_all=False):
+        """ Saves the caches filled while listing the mods. If the whole
+        library has been listed ('listed_all'), the listings of the
+        archives which have not been listed, no longer being in the
+        library, are dropped first. """
+        if listed_all and self.listing_cache is not None:
+            self.listing_cache.prune()
+        for name in self.listing_caches:
+            if getattr(self, name) is not None:
+                getattr(self, name).save()
+
+    def used_cache_entries(self):
+        """ Returns the entries of the listing caches used by this
+        process, by cache. """
+        return dict((name, getattr(self, name).used_items())
+                    for name in self.listing_caches
+                    if getattr(self, name) is not None)
+
+    def write_shard(self, filename, shard=None, directory=None):
+        """ Lists a shard of the library, ie. the archives of the shard
+        (index, count) if given and of the subdirectory 'directory' of the
+        source directory if given, and writes their partial index. """
+        self.init_analysis()
+        self.shard = shard
+        if directory:
+            directory = os.path.join(self.cfg.path['src_dir'], directory)
+        self.write_index(filename, directory)
+
+    def write_index(self, filename, directory=None):
+        """ Lists the mods and writes their partial index. """
+        self.index_writer = ModIndexWriter(filename)
+        self.list_mods(directory)
+        # Plugins are read here since the merging host may not
+        # have access to the archives.
+        if self.cfg.option['plugin_masters']:
+            self.read_plugin_masters()
+            for fhash in set(plugin[3] for plugin in self.plugin_files):
+                self.index_writer.add_masters(fhash,
+                                              self.plugin_cache.get(fhash))
+        self.index_writer.close()
+        self.progress.close()
+        self.cfg.log("\t- Wrote the index of %d data files to '%s'." % (
+            self.datafile_count, filename))
+
+    def merge_indexes(self, filenames):
+        """ Loads the partial indexes written by shards of the library.
+        The mods are loaded in the order they would be listed by a single
+        process, which keeps the first of identical versions of a file.
+        The mods of the excluded directories of the configuration
+        are skipped. """
+        self.init_index()
+        is_excluded = name_matcher(self.cfg.path['excluded_dirs'])
+        excluded_mods = {}
+
+        def mod_key(mod):
+            # Unpacked mods are directories, discovered with their siblings
+            return discovery_key(mod, os.path.splitext(mod)[1].lower()
+                                 not in supported_archive_extensions)
+
+        for kind, values in read_indexes(filenames, mod_key):
+            if kind in ('file', 'mod'):
+                mod = values[4] if kind == 'file' else values[0]
+                if mod not in excluded_mods:
+                    excluded_mods[mod] = any(is_excluded(d) for d in
+                            os.path.dirname(mod).split(os.sep))
+                if excluded_mods[mod]:
+                    continue
+            if kind == 'file':
+                self.add_file(*values)
+            elif kind == 'mod':
+                self.mod_list.append(values[0])
+                self.add_mod(*values)
+            elif kind == 'masters' and values[0] not in self.plugin_cache:
+                self.plugin_cache.set(*values)
+
+    def list_local_shards(self, count):
+        """ Lists the library in 'count' worker processes,
+        then merges their partial indexes. """
+        filenames = [os.path.join(self.cfg.path['cache_dir'],
+                                  'shard%03d.index' % i) for i in range(count)]
+        pool = multiprocessing.Pool(count)
+        # The workers return their cache entries rather than saving the
+        # caches themselves, which would only keep those of the last one.
+        for entries in pool.imap_unordered(_list_shard,
+                [(self.config_file, filename, (i, count))
+                 for i, filename in enumerate(filenames)]):
+            for name, items in entries.iteritems():
+                getattr(self, name).update(items)
+        pool.close()
+        pool.join()
+        self.save_caches(True)
+        self.merge_indexes(filenames)
+        for filename in filenames:
+            os.remove(filename)
+
+    def order_profiles(self, config_files, index_files=None):
+        """ Lists the archives once, unless the partial index files
+        'index_files' are given, then orders the mods of every profile
+        (configuration file) in parallel processes. The outputs of each
+        profile are written to its own output directory. """
+        tstart = time.time()
+        profiles = []
+        for config_file in config_files:
+            cfg = ModConfig(config_file)
+            cfg.log_fd.close()
+            profiles.append(cfg)
+        for i, cfg in enumerate(profiles):
+            if cfg.path['src_dir'] != profiles[0].path['src_dir']:
+                raise ModConfigError("The profiles '%s' and '%s' have "\
+                        "different source directories." % (
+                            config_files[0], config_files[i]))
+            for j in range(i):
+                if cfg.path['out_dir'] == profiles[j].path['out_dir']:
+                    raise ModConfigError("The profiles '%s' and '%s' have "\
+                            "the same output directory." % (
+                                config_files[j], config_files[i]))
+
+        self.init_analysis()
         self.cfg.log("\nBetter Install Order, run on %s" % time.ctime())
+        if not index_files:
+            # The archives of the directories excluded by a profile only
+            # are listed, then skipped when merging the index.
+            self.cfg.path['excluded_dirs'] = set.intersection(
+                    *[cfg.path['excluded_dirs'] for cfg in profiles])
+            self.cfg.path['excluded_arc_dirs'] = set.intersection(
+                    *[cfg.path['excluded_arc_dirs'] for cfg in profiles])
+            self.cfg.option['plugin_masters'] = any(
+                    cfg.option['plugin_masters'] for cfg in profiles)
+            index_files = [os.path.join(self.cfg.path['cache_dir'],
+                                        'profiles.index')]
+            self.write_index(index_files[0])
 
-        self.mod_graph = ModGraph(self.cfg)
+        pool = multiprocessing.Pool(min(len(config_files),
+                                        multiprocessing.cpu_count()))
+        pool.map(_order_profile, [(config_file, index_files)
+                                  for config_file in config_files])
+        pool.close()
+        pool.join()
 
-        self.traverse_archives(self.cfg.path['src_dir'])
+        self.cfg.log("\t- Ordered %d profiles in %.2fs" % (
+            len(config_files), time.time() - tstart))
+        self.cfg.log("\nRun 'bio.py -c FILE --merge %s' to apply the disk "\
+                "operations of the profile FILE without listing the archives "\
+                "again." % ' '.join(index_files))
+        self.progress.close()
+        self.cfg.log_fd.close()
 
-        if len(self.datafile_list) == 0:
+    def order_profile(self, index_files):
+        """ Orders the mods of a profile from partial index files, without
+        any disk operation. """
+        tstart = time.time()
+        self.init_analysis()
+        self.cfg.log("\nProfile '%s', run on %s" % (self.config_file,
+                                                    time.ctime()))
+        self.merge_indexes(index_files)
+        try:
+            self.order_mods()
+        except SystemExit:
+            # No overlapping mods in this profile
+            pass
+        self.cfg.log("\t- Process time of profile '%s': %.2fs" % (
+            self.config_file, time.time() - tstart))
+        self.progress.close()
+        self.cfg.log_fd.close()
+
+    def order_mods(self):
+        """ Builds the graph of the overlapping mods which have been listed,
+        orders them and writes the reports. """
+        if self.datafile_count == 0:
             raise ModAnalysisError("No archives found in the '%s' directory." %
                     self.cfg.path['src_dir'])
         else:
             self.cfg.log("\t- Found %d module archives." %
                     self.mod_graph.node_count())
 
+        if self.cfg.option['verify_archives']:
+            self.start_verification()
+
+        if self.similarity is not None:
+            self.set_superseded_mods()
+
         self.set_overlapping_datafiles()
 
+        if self.cfg.option['plugin_masters']:
+            self.set_plugin_masters()
+
         if len(self.overlapping_datafiles) == 0:
             self.cfg.log("There is no overlapping module, nothing to do.")
             exit()
 
+        if self.cfg.quality_coeff > 0:
+            self.inspect_textures()
+
         self.overlapping_datafiles_to_graph()
 
         self.cfg.log("\t- Found %d overlapping module archives." %
                 self.mod_graph.node_count())
 
         self.mod_graph.set_edge_props()
+        if self.stability_runs > 0:
+            ratios_graph = self.mod_graph.copy_ratios()
         self.mod_graph.set_directions()
+        self.mod_graph.prune_edges()
         self.mod_graph.break_cycles()
+        self.ordered_overlap_mod = self.mod_graph.order_pruned()
+        # Counted once the pruned edges are back in the graph
         self.mod_graph.count_mod_overlapped_files()
-        self.ordered_overlap_mod = self.mod_graph.tsort_graph()
         self.mod_graph.restore_cycles()
         self.set_free_mod()
+        if self.verification is not None:
+            self.finish_verification()
         self.prepare_disk_operations()
         self.write_info_files()
+        self.write_order_diff()
+        write_snapshot(self.cfg.path['snapshot'], self.mod_graph,
+                       self.ordered_overlap_mod)
+        self.fingerprint_cache.save()
+        if self.stability_runs > 0:
+            self.write_stability(ratios_graph)
+
+    def mod_analysis(self, index_files=None, shard_count=None):
+        """ Runs the whole analysis. The archives are listed by this
+        process, by 'shard_count' local worker processes, or have been
+        listed beforehand into the partial index files 'index_files'. """
+        tstart = time.time()
+        self.init_analysis()
+
+        self.cfg.log("\nBetter Install Order, run on %s" % time.ctime())
+
+        if index_files:
+            self.merge_indexes(index_files)
+        elif shard_count > 1:
+            self.list_local_shards(shard_count)
+        else:
+            self.list_mods()
+
+        self.order_mods()
 
         self.cfg.log("\t- Process time: %.2fs" % (time.time() - tstart))
 
         self.copy_rename_mods()
 
+        self.progress.close()
         self.cfg.log_fd.close()
 
 
@@ -378,5 +1509,9 @@ if __name__ == "__main__":
         print "\nGraph Processing Error: " + e.msg
     except ModConfigError as e:
         print "\nConfiguration Error: " + e.msg
+    except ModIndexError as e:
+        print "\nIndex Error: " + e.msg
+    except ModSnapshotError as e:
+        print "\nSnapshot Error: " + e.msg
     except AssertionError as e:
         print e.args[0]
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Partial extraction of archive entries through the archive program.
+Entries are extracted to a pipe, never to the disk, and the archive
+program is stopped as soon as the needed bytes have been read.
+Zip archives nested in an archive are listed from memory, and archives
+can also be tested by the archive program.
+"""
+
+import os
+import time
+import zipfile
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+from cStringIO import StringIO
+from io import BytesIO
+
+__all__ = ["open_entry", "read_entry_head", "list_zip_entry",
+           "test_archive", "ModArchiveTimeout", "no_prompt_args"]
+
+# Arguments of the archive program making it fail on encrypted archives,
+# instead of prompting for their password on the terminal and blocking
+# the threads reading archives: a dummy password, and no standard input.
+no_prompt_args = ['-pbio']
+
+# Nested zip archives are read in memory one at a time
+_zip_read_lock = threading.Lock()
+
+
+class ModArchiveTimeout(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+
+@contextmanager
+def open_entry(archive, arcfile, entry):
+    """ Gives a file object streaming the entry 'entry' of the archive
+    'arcfile'. The archive program is stopped when leaving the context,
+    even if the entry has not been read entirely. 'arcfile' may also be
+    an unpacked mod directory, whose file is then opened directly. """
+    if os.path.isdir(arcfile):
+        try:
+            stream = open(os.path.join(arcfile, entry), 'rb')
+        except IOError:
+            stream = BytesIO()
+        with stream:
+            yield stream
+        return
+    with open(os.devnull, 'r+b') as devnull:
+        arcproc = subprocess.Popen(
+                [archive, 'e', '-so'] + no_prompt_args + [arcfile, entry],
+                stdin=devnull, stdout=subprocess.PIPE, stderr=devnull)
+        try:
+            yield arcproc.stdout
+        finally:
+            arcproc.stdout.close()
+            if arcproc.poll() is None:
+                arcproc.kill()
+            arcproc.wait()
+
+
+def read_entry_head(archive, arcfile, entry, size):
+    """ Returns at most the first 'size' bytes of the entry 'entry' of the
+    archive 'arcfile', or '' if it cannot be extracted. """
+    with open_entry(archive, arcfile, entry) as stream:
+        return stream.read(size)
+
+
+def list_zip_entry(archive, arcfile, entry, max_size):
+    """ Returns the (path, size, mtime, CRC) of the files of the zip archive
+    'entry' of the archive 'arcfile', read in memory by the zipfile module,
+    or None if it is larger than 'max_size' bytes or is not a zip archive.
+    Sizes and times are formatted as listed by the archive program. """
+    with _zip_read_lock:
+        data = read_entry_head(archive, arcfile, entry, max_size + 1)
+        if len(data) > max_size:
+            return None
+        try:
+            # Unlike BytesIO, StringIO reads the data without a copy
+            infos = zipfile.ZipFile(StringIO(data)).infolist()
+        except (zipfile.BadZipfile, zipfile.LargeZipFile, IOError):
+            return None
+    return [(info.filename.replace('/', os.sep), str(info.file_size),
+             '%04d-%02d-%02d %02d:%02d:%02d' % info.date_time,
+             '%08X' % (info.CRC & 0xffffffff))
+            for info in infos
+            if info.file_size and not info.filename.endswith('/')]
+
+
+def test_archive(archive, arcfile, timeout=0):
+    """ Tests the integrity of the archive 'arcfile' with the archive
+    program, stopping it after 'timeout' seconds (0 meaning no limit), in
+    which case ModArchiveTimeout is raised. Returns None if the archive is
+    sound, or the reason of the failure. """
+    tstart = time.time()
+    with tempfile.TemporaryFile() as output, \
+            open(os.devnull, 'rb') as devnull:
+        arcproc = subprocess.Popen([archive, 't'] + no_prompt_args + [arcfile],
+                stdin=devnull, stdout=output, stderr=subprocess.STDOUT)
+        while arcproc.poll() is None:
+            if timeout and time.time() - tstart > timeout:
+                arcproc.kill()
+                arcproc.wait()
+                raise ModArchiveTimeout("Test stopped after %ds." %
+                                        timeout)
+            time.sleep(0.05)
+        if arcproc.returncode == 0:
+            return None
+        output.seek(0)
+        # The last lines of the archive program explain the failure
+        lines = [line.strip() for line in output.read().splitlines()
+                 if line.strip()]
+    return ' / '.join(lines[-3:]) or (
+            "Test failed with code %d." % arcproc.returncode)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import cPickle
+import tempfile
+
+__all__ = ["ModCache"]
+
+
+class ModCache(object):
+    """ Dictionary persisted in a file between two runs of BIO.
+    The file is simply ignored if it is unreadable or has been written by
+    another version of the cache format.
+    """
+
+    version = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = {}
+        self.modified = False
+        # Keys read or written since the cache was loaded
+        self.used = set()
+        if os.path.exists(filename):
+            try:
+                with open(filename, 'rb') as stream:
+                    version, data = cPickle.load(stream)
+                if version == self.version:
+                    self.data = data
+            except (EOFError, ValueError, TypeError, cPickle.PickleError):
+                pass
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        if key in self.data:
+            self.used.add(key)
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.used.add(key)
+        self.modified = True
+
+    def used_items(self):
+        """ Returns the entries read or written since the cache was
+        loaded, eg. to be merged into the cache of another process. """
+        return dict((key, self.data[key]) for key in self.used)
+
+    def update(self, items):
+        for key, value in items.iteritems():
+            self.set(key, value)
+
+    def prune(self):
+        """ Removes the entries which have not been used since the cache
+        was loaded. """
+        if len(self.used) < len(self.data):
+            self.data = self.used_items()
+            self.modified = True
+
+    def save(self):
+        """ Writes the cache file if the cache has been modified. """
+        if not self.modified:
+            return
+        # A temporary file of its own, as other processes may save the same
+        # cache at the same time, the last one replacing the file.
+        fd, tmp_filename = tempfile.mkstemp(
+                prefix='%s.' % os.path.basename(self.filename),
+                dir=os.path.dirname(self.filename) or '.')
+        with os.fdopen(fd, 'wb') as stream:
+            cPickle.dump((self.version, self.data), stream,
+                    cPickle.HIGHEST_PROTOCOL)
+        try:
+            if os.name == 'nt' and os.path.exists(self.filename):
+                # Files cannot be replaced by a rename on Windows
+                os.remove(self.filename)
+            os.rename(tmp_filename, self.filename)
+        except OSError:
+            os.remove(tmp_filename)
+            raise
+        self.modified = False
@@ -20,8 +20,11 @@
 
 import os
 import re
+import multiprocessing
 import ConfigParser
 
+from mod_fas import fas_solvers, exact_nodes_limit
+
 __all__ = ["ModConfig", "ModConfigError"]
 
 
@@ -37,22 +40,30 @@ class ModConfig(object):
     paths to directories and file names.
     """
 
-    path = {}
-    tool = {}
-    precedence = {}
-    coefficient = {}
     size_coeff = None
     mtime_coeff = None
     fc_coeff = None
+    quality_coeff = None
 
     def __init__(self, ini_file):
+        # Per instance, several configurations (profiles) may be loaded
+        self.path = {}
+        self.tool = {}
+        self.option = {}
+        self.precedence = {}
+        self.coefficient = {}
         cfg = ConfigParser.ConfigParser()
-        cfg.readfp(open(ini_file))
+        try:
+            cfg.readfp(open(ini_file))
+        except IOError:
+            raise ModConfigError("Cannot read the configuration file '%s'." %
+                    ini_file)
         try:
             self.set_paths(cfg)
             self.set_force_precedence(cfg)
             self.set_criterion_coeffs(cfg)
             self.set_mod_coeffs(cfg)
+            self.set_options(cfg)
         except ConfigParser.NoOptionError as msg:
             raise ModConfigError(
                     'An entry is missing in the configuration file:\n%s\t' %
@@ -61,7 +72,15 @@ class ModConfig(object):
         self.log_fd = open('%s' % self.path['log'], 'a')
         self.log_fd.write("\n")
 
+    def __getstate__(self):
+        # Copies given to other processes do not log anything
+        state = self.__dict__.copy()
+        state['log_fd'] = None
+        return state
+
     def log(self, msg, display=True):
+        if self.log_fd is None:
+            return
         self.log_fd.write("%s\n" % msg)
         if display:
             print msg
@@ -84,13 +103,18 @@ class ModConfig(object):
         else:
             return 0
 
+    def add_precedence(self, mod1, mod2):
+        """ Forces the precedence of mod1 over mod2. """
+        mod1 = os.path.basename(mod1).lower()
+        mod2 = os.path.basename(mod2).lower()
+        if mod1 not in self.precedence:
+            self.precedence[mod1] = []
+        if mod2 not in self.precedence[mod1]:
+            self.precedence[mod1].append(mod2)
+
     def set_force_precedence(self, cfg):
         for mod1, mod2 in cfg.items('mod_precedences'):
-            mod1 = mod1.lower()
-            mod2 = mod2.lower()
-            if mod1 not in self.precedence:
-                self.precedence[mod1] = []
-            self.precedence[mod1].append(mod2)
+            self.add_precedence(mod1, mod2)
 
     def set_criterion_coeffs(self, cfg):
         try:
@@ -100,11 +124,16 @@ class ModConfig(object):
                     cfg.get('criterion_coefficients', 'mtime_coeff'))
             self.fc_coeff = float(
                     cfg.get('criterion_coefficients', 'file_count_coeff'))
+            # Optional, as it requires to read the overlapping textures
+            self.quality_coeff = 0.0
+            if cfg.has_option('criterion_coefficients', 'quality_coeff'):
+                self.quality_coeff = float(
+                        cfg.get('criterion_coefficients', 'quality_coeff'))
         except ValueError as msg:
             raise ModConfigError(
                     "Invalid criterion coefficient value:\n%s\t" % str(msg))
         if (self.size_coeff < 0.0 or self.mtime_coeff < 0.0 or
-                self.fc_coeff < 0.0):
+                self.fc_coeff < 0.0 or self.quality_coeff < 0.0):
             raise ModConfigError(
                     "Criterion coefficients cannot be lower than '0'.")
 
@@ -127,6 +156,133 @@ class ModConfig(object):
                 raise ModConfigError("Mod coefficients cannot be '0'.")
             self.coefficient[mod] = coeff
 
+    def get_option(self, cfg, section, key, default, conv=str):
+        """ Returns an optional entry of the configuration file converted
+        by 'conv', or 'default' if the entry is missing. """
+        if not cfg.has_option(section, key):
+            return default
+        try:
+            if conv is bool:
+                return cfg.getboolean(section, key)
+            return conv(cfg.get(section, key))
+        except ValueError:
+            raise ModConfigError("Invalid value for '%s': '%s'" %
+                    (key, cfg.get(section, key)))
+
+    def set_options(self, cfg):
+        # Number of worker threads used to read archives
+        self.option['jobs'] = max(1, self.get_option(
+                cfg, 'analysis', 'jobs', multiprocessing.cpu_count(), int))
+        # List the archives in worker threads, overlaps being added to the
+        # graph as the listed archives are merged into the index.
+        self.option['pipeline'] = self.get_option(
+                cfg, 'analysis', 'pipeline', True, bool)
+        # Archives listed at once on a spinning disk or a network share,
+        # 0 meaning as many as on other devices.
+        self.option['device_jobs'] = self.get_option(
+                cfg, 'analysis', 'device_jobs', 1, int)
+        if self.option['device_jobs'] < 0:
+            raise ModConfigError("'device_jobs' must be positive or 0.")
+        # List the archives nested in archives holding no data file
+        self.option['nested_archives'] = self.get_option(
+                cfg, 'analysis', 'nested_archives', True, bool)
+        # Maximum size in MB of the nested zip archives, read in memory
+        self.option['nested_max_size'] = self.get_option(
+                cfg, 'analysis', 'nested_max_size', 256, int)
+        # Hint the kernel to read ahead the next archive of a slow device
+        self.option['readahead'] = self.get_option(
+                cfg, 'analysis', 'readahead', True, bool)
+        # Maximum number of overlapping files listed per edge in the
+        # overlaps report, 0 meaning all of them.
+        self.option['report_max_files'] = self.get_option(
+                cfg, 'analysis', 'report_max_files', 20, int)
+        if self.option['report_max_files'] < 0:
+            raise ModConfigError(
+                    "'report_max_files' cannot be lower than '0'.")
+        # Feedback arc set solver used to break precedence cycles
+        self.option['fas_solver'] = self.get_option(
+                cfg, 'analysis', 'fas_solver', 'local_ratio')
+        if self.option['fas_solver'] not in fas_solvers:
+            raise ModConfigError("Unknown feedback arc set solver '%s', "\
+                    "expected one of: %s." % (self.option['fas_solver'],
+                        ', '.join(sorted(fas_solvers))))
+        self.option['fas_exact_max_nodes'] = self.get_option(
+                cfg, 'analysis', 'fas_exact_max_nodes', 12, int)
+        if not 0 <= self.option['fas_exact_max_nodes'] <= exact_nodes_limit:
+            raise ModConfigError("'fas_exact_max_nodes' must be between 0 "\
+                    "and %d." % exact_nodes_limit)
+        # Overlaps pruned before the cycles are broken: those with fewer
+        # files or bytes than these minimums, or whose score is within
+        # the band above 1. 0 disables a criterion.
+        self.option['prune_min_files'] = self.get_option(
+                cfg, 'analysis', 'prune_min_files', 0, int)
+        self.option['prune_min_bytes'] = self.get_option(
+                cfg, 'analysis', 'prune_min_bytes', 0, int)
+        self.option['prune_score_band'] = self.get_option(
+                cfg, 'analysis', 'prune_score_band', 0.0, float)
+        if (min(self.option['prune_min_files'],
+                self.option['prune_min_bytes'],
+                self.option['prune_score_band']) < 0):
+            raise ModConfigError("The 'prune_*' options must be positive "\
+                    "or 0.")
+        # Plugin master dependencies are turned into forced precedences
+        self.option['plugin_masters'] = self.get_option(
+                cfg, 'analysis', 'plugin_masters', True, bool)
+        # Memory ceiling, in MB, of the data file index before it is
+        # spilled to disk, 0 meaning the whole index is kept in memory.
+        self.option['memory_limit'] = self.get_option(
+                cfg, 'analysis', 'memory_limit', 0, int)
+        if self.option['memory_limit'] < 0:
+            raise ModConfigError("'memory_limit' must be positive or 0.")
+        # Files contained in BSA archives are analysed as data files
+        self.option['expand_bsa'] = self.get_option(
+                cfg, 'analysis', 'expand_bsa', True, bool)
+        # Minimum similarity of the file sets of two mods for them to be
+        # near-duplicates (0 disables the detection), and whether the
+        # superseded ones are left out of the analysis.
+        self.option['similarity_threshold'] = self.get_option(
+                cfg, 'analysis', 'similarity_threshold', 0.8, float)
+        if not 0.0 <= self.option['similarity_threshold'] <= 1.0:
+            raise ModConfigError(
+                    "'similarity_threshold' must be between '0' and '1'.")
+        self.option['exclude_superseded'] = self.get_option(
+                cfg, 'analysis', 'exclude_superseded', False, bool)
+        # Archives are tested by the archive program, those failing the
+        # test being left out of the disk operations. A test is stopped
+        # after 'verify_timeout' seconds (0 meaning no limit).
+        self.option['verify_archives'] = self.get_option(
+                cfg, 'analysis', 'verify_archives', False, bool)
+        self.option['verify_timeout'] = self.get_option(
+                cfg, 'analysis', 'verify_timeout', 300, float)
+        # Interactive HTML report of the overlaps
+        self.option['html_report'] = self.get_option(
+                cfg, 'analysis', 'html_report', True, bool)
+        # Progress of the long stages, on the console and as JSON lines
+        # in the file 'progress_file' if given, reported at most once
+        # every 'progress_interval' seconds.
+        self.option['progress'] = self.get_option(
+                cfg, 'analysis', 'progress', True, bool)
+        self.option['progress_file'] = self.get_option(
+                cfg, 'analysis', 'progress_file', '')
+        if self.option['progress_file']:
+            self.option['progress_file'] = os.path.abspath(
+                    os.path.expanduser(self.option['progress_file']))
+        self.option['progress_interval'] = self.get_option(
+                cfg, 'analysis', 'progress_interval', 1.0, float)
+        # Standard deviation of the logarithm of the random factors applied
+        # to the scores by the stability analysis.
+        self.option['stability_sigma'] = self.get_option(
+                cfg, 'analysis', 'stability_sigma', 0.1, float)
+        if self.option['stability_sigma'] <= 0:
+            raise ModConfigError(
+                    "'stability_sigma' must be greater than '0'.")
+        # Number of dot processes run in parallel, and maximum time
+        # in seconds given to each of them (0 meaning no limit).
+        self.option['dot_jobs'] = max(1, self.get_option(
+                cfg, 'tools', 'dot_jobs', 2, int))
+        self.option['dot_timeout'] = self.get_option(
+                cfg, 'tools', 'dot_timeout', 300, float)
+
     def set_paths(self, cfg):
         def _path(path):
             return os.path.abspath(os.path.expanduser(path))
@@ -185,6 +341,13 @@ class ModConfig(object):
             self.path[key] = _path(cfg.get('analysis', key))
             file_write_test(key)
 
+        def set_optional_filename(key, default):
+            """ Defaults to the file named 'default' in the output dir. """
+            if cfg.has_option('analysis', key):
+                set_filename(key)
+            else:
+                self.path[key] = os.path.join(self.path['out_dir'], default)
+
         # The installers directory is mandatory.
         self.path['tgt_dir'] = _dir(cfg.get('modules', 'target_directory'))
         dir_write_test('tgt_dir')
@@ -209,6 +372,9 @@ class ModConfig(object):
             cfg.get('modules','excluded_directory_analysis'))
         self.path['excluded_arc_dirs'] = get_list(
             cfg.get('modules','excluded_archive_directory_analysis'))
+        # Name of the file marking a directory as an unpacked mod
+        self.path['project_marker'] = self.get_option(
+                cfg, 'modules', 'project_marker', 'bio_project.txt')
 
         set_tools('archive')
         set_tools('dot', True)
@@ -221,4 +387,21 @@ class ModConfig(object):
 
         set_filename('suspicious')
         set_filename('overlaps')
+        # Report of the near-duplicate mods
+        set_optional_filename('similar', 'similar.txt')
+        # Install order saved by the last run, and its differences with
+        # the one saved by the run before.
+        set_optional_filename('order_state', 'order_state.json')
+        set_optional_filename('order_diff', 'order_diff.txt')
+        # Snapshot of the last analysis
+        set_optional_filename('snapshot', 'analysis.snapshot')
+        # Report of the stability analysis
+        set_optional_filename('stability', 'stability.txt')
+
+        # Directory of the files kept between two runs
+        self.path['cache_dir'] = _dir(
+                cfg.get('analysis', 'cache_dir')
+                if cfg.has_option('analysis', 'cache_dir')
+                else os.path.join(self.path['out_dir'], 'cache'))
+        dir_write_test('cache_dir', True)
 
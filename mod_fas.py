@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Minimum weight feedback arc set solvers.
+
+Every solver takes a weighted directed graph as a dictionary
+{node: {successor: weight}}, every node being a key, and returns the list
+of arcs (node, successor) to remove so that the graph becomes acyclic.
+The solvers are meant to be applied on a single strongly connected
+component at a time.
+"""
+
+import heapq
+
+__all__ = ["fas_solvers", "feedback_arc_set", "exact_nodes_limit"]
+
+# Residual weights below this fraction of the original weight are
+# considered null by the local ratio solver.
+epsilon = 1e-9
+# Largest component the exact solver can be configured for, its time and
+# memory doubling with each node.
+exact_nodes_limit = 20
+
+
+def _find_cycle(graph):
+    """ Returns a cycle of the graph as a list of nodes, the first node being
+    repeated at the end, or None if the graph is acyclic. """
+    # 0: unvisited, 1: on the current path, 2: done
+    state = dict.fromkeys(graph, 0)
+    for root in graph:
+        if state[root]:
+            continue
+        state[root] = 1
+        path = [root]
+        work = [iter(graph[root])]
+        while work:
+            for succ in work[-1]:
+                if state[succ] == 1:
+                    return path[path.index(succ):] + [succ]
+                if state[succ] == 0:
+                    state[succ] = 1
+                    path.append(succ)
+                    work.append(iter(graph[succ]))
+                    break
+            else:
+                state[path.pop()] = 2
+                work.pop()
+    return None
+
+
+def _reaches(graph, source, target):
+    """ Tells whether there is a path from source to target. """
+    seen = set([source])
+    todo = [source]
+    while todo:
+        node = todo.pop()
+        if node == target:
+            return True
+        for succ in graph[node]:
+            if succ not in seen:
+                seen.add(succ)
+                todo.append(succ)
+    return False
+
+
+def _backward_arcs(weights, order):
+    """ Returns the arcs going backward according to a linear order. """
+    position = dict((node, i) for i, node in enumerate(order))
+    return [(node, succ) for node in weights for succ in weights[node]
+            if position[succ] < position[node]]
+
+
+def local_ratio(weights):
+    """ Local ratio heuristic described in "Combinatorial Algorithms for
+    Feedback Problems in Directed Graphs" by Camil Demetrescu and Irene
+    Finocchi: while there is a cycle, its minimum weight is subtracted from
+    each of its arcs, and arcs whose weight drops to zero are removed. """
+    graph = dict((node, dict(weights[node])) for node in weights)
+    fas = []
+    cycle = _find_cycle(graph)
+    while cycle is not None:
+        arcs = zip(cycle[:-1], cycle[1:])
+        minval = min(graph[n1][n2] for n1, n2 in arcs)
+        for n1, n2 in arcs:
+            graph[n1][n2] -= minval
+            if graph[n1][n2] <= epsilon * weights[n1][n2]:
+                del graph[n1][n2]
+                fas.append((n1, n2))
+        cycle = _find_cycle(graph)
+    return fas
+
+
+def greedy(weights):
+    """ Greedy ordering heuristic described in "A fast and effective
+    heuristic for the feedback arc set problem" by Peter Eades, Xuemin Lin
+    and William F. Smyth, weighted version: sinks are repeatedly moved to the
+    end of the order, sources to its beginning, and otherwise the node with
+    the greatest (outgoing - incoming) weight is moved to the beginning. """
+    succs = dict((node, dict(weights[node])) for node in weights)
+    preds = dict((node, {}) for node in weights)
+    for node in weights:
+        for succ, weight in weights[node].iteritems():
+            preds[succ][node] = weight
+    delta = dict((node, sum(succs[node].itervalues()) -
+                  sum(preds[node].itervalues())) for node in weights)
+    heap = [(-delta[node], node) for node in weights]
+    heapq.heapify(heap)
+    sinks = [node for node in weights if not succs[node]]
+    sources = [node for node in weights if succs[node] and not preds[node]]
+    head = []
+    tail = []
+    left = set(weights)
+
+    def remove(node):
+        left.discard(node)
+        for succ, weight in succs.pop(node).iteritems():
+            del preds[succ][node]
+            delta[succ] += weight
+            heapq.heappush(heap, (-delta[succ], succ))
+            if not preds[succ] and succs[succ]:
+                sources.append(succ)
+        for pred, weight in preds.pop(node).iteritems():
+            del succs[pred][node]
+            delta[pred] -= weight
+            heapq.heappush(heap, (-delta[pred], pred))
+            if not succs[pred]:
+                sinks.append(pred)
+
+    while left:
+        if sinks:
+            node = sinks.pop()
+            if node in left:
+                tail.append(node)
+                remove(node)
+        elif sources:
+            node = sources.pop()
+            if node in left:
+                head.append(node)
+                remove(node)
+        else:
+            neg_delta, node = heapq.heappop(heap)
+            if node in left and -neg_delta == delta[node]:
+                head.append(node)
+                remove(node)
+    tail.reverse()
+    return _backward_arcs(weights, head + tail)
+
+
+def exact(weights, max_nodes=12):
+    """ Optimal solution computed by dynamic programming over the subsets of
+    nodes: the cost of a subset is the minimum weight of the arcs going
+    backward when its nodes are placed first in the order. Runs in
+    O(2^n * n^2), the greedy heuristic being used instead for components
+    of more than 'max_nodes' nodes. """
+    nodes = list(weights)
+    count = len(nodes)
+    if count > max_nodes:
+        return greedy(weights)
+    bit = dict((node, 1 << i) for i, node in enumerate(nodes))
+    out_arcs = [[(bit[succ], weight)
+                 for succ, weight in weights[node].iteritems()]
+                for node in nodes]
+    full = (1 << count) - 1
+    cost = [0.0] * (full + 1)
+    last = [0] * (full + 1)
+    for subset in xrange(1, full + 1):
+        best = None
+        for i in xrange(count):
+            if not subset & (1 << i):
+                continue
+            rest = subset & ~(1 << i)
+            # Node i placed last: its arcs toward the nodes placed before
+            # it are going backward.
+            value = cost[rest] + sum(
+                    weight for mask, weight in out_arcs[i] if rest & mask)
+            if best is None or value < best:
+                best = value
+                last[subset] = i
+        cost[subset] = best
+    order = []
+    subset = full
+    while subset:
+        i = last[subset]
+        order.append(nodes[i])
+        subset &= ~(1 << i)
+    order.reverse()
+    return _backward_arcs(weights, order)
+
+
+fas_solvers = {
+        'local_ratio': local_ratio,
+        'greedy': greedy,
+        'exact': exact,
+        }
+
+
+def feedback_arc_set(weights, solver='local_ratio', exact_max_nodes=12):
+    """ Returns a feedback arc set of the graph computed by the given
+    solver. The removed arcs are then tried to be added back, heaviest
+    first, as long as they do not create a new cycle. """
+    if solver == 'exact':
+        fas = exact(weights, exact_max_nodes)
+    else:
+        fas = fas_solvers[solver](weights)
+    graph = dict((node, set(weights[node])) for node in weights)
+    for n1, n2 in fas:
+        graph[n1].discard(n2)
+    kept = []
+    for n1, n2 in sorted(fas, key=lambda arc: -weights[arc[0]][arc[1]]):
+        if _reaches(graph, n2, n1):
+            kept.append((n1, n2))
+        else:
+            graph[n1].add(n2)
+    return kept
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+""" File system traversal helpers. """
+
+import os
+import re
+import stat
+import zlib
+import hashlib
+import threading
+import fnmatch
+from multiprocessing.pool import ThreadPool
+
+# scandir gives the type of the directory entries without an extra stat()
+# call. It is part of the standard library since Python 3.5; on Python 2
+# this speed-up needs the third-party 'scandir' module (pip install
+# scandir), listdir + stat being used without it.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+__all__ = ["scan_dir", "scan_tree", "file_crc", "file_fingerprint",
+           "name_matcher", "discover", "discovery_key"]
+
+# Bytes hashed at each end of a file by file_fingerprint
+fingerprint_block_size = 1 << 16
+
+
+def scan_dir(path, stat_files=True):
+    """ Returns the (files, subdirectories) of a directory, files being
+    (name, size, mtime) tuples. Without 'stat_files', sizes and times are
+    None and, with scandir, no stat() call is needed on most file systems,
+    the entry types being given by the directory listing itself. """
+    files = []
+    dirs = []
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir():
+                dirs.append(entry.name)
+            elif stat_files:
+                st = entry.stat()
+                files.append((entry.name, st.st_size, st.st_mtime))
+            else:
+                files.append((entry.name, None, None))
+    else:
+        for name in os.listdir(path):
+            st = os.stat(os.path.join(path, name))
+            if stat.S_ISDIR(st.st_mode):
+                dirs.append(name)
+            elif stat_files:
+                files.append((name, st.st_size, st.st_mtime))
+            else:
+                files.append((name, None, None))
+    return files, dirs
+
+
+def scan_tree(root, jobs):
+    """ Yields the (relative path, size, mtime) of every file below the
+    directory 'root', the directories of a same depth being scanned by a
+    pool of 'jobs' threads. """
+    pool = ThreadPool(jobs)
+    try:
+        level = ['']
+        while level:
+            results = pool.map(scan_dir,
+                               [os.path.join(root, d) for d in level])
+            next_level = []
+            for reldir, (files, dirs) in zip(level, results):
+                for name, size, mtime in files:
+                    yield os.path.join(reldir, name), size, mtime
+                next_level.extend(os.path.join(reldir, d) for d in dirs)
+            level = next_level
+    finally:
+        pool.close()
+        pool.join()
+
+
+def file_crc(path):
+    """ Returns the CRC32 of a file, formatted as by the archive program. """
+    crc = 0
+    with open(path, 'rb') as stream:
+        while 1:
+            data = stream.read(1 << 16)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+    return '%08X' % (crc & 0xffffffff)
+
+
+def file_fingerprint(path, size=None):
+    """ Returns a cheap fingerprint of the content of a file: its size and
+    the MD5 of its first and last blocks, where archive formats keep their
+    headers and directory. It does not depend on the name of the file. """
+    with open(path, 'rb') as stream:
+        if size is None:
+            size = os.fstat(stream.fileno()).st_size
+        md5 = hashlib.md5(stream.read(fingerprint_block_size))
+        if size > fingerprint_block_size:
+            stream.seek(max(fingerprint_block_size,
+                            size - fingerprint_block_size))
+            md5.update(stream.read(fingerprint_block_size))
+    return '%d:%s' % (size, md5.hexdigest())
+
+
+def name_matcher(patterns):
+    """ Returns a function telling whether a name matches one of the given
+    (case insensitive, shell-style) patterns, compiled once into a single
+    regular expression. """
+    if not patterns:
+        return lambda name: False
+    regexp = re.compile('|'.join(fnmatch.translate(pattern)
+                                 for pattern in patterns), re.IGNORECASE)
+    return lambda name: regexp.match(name) is not None
+
+
+def discovery_key(path, is_directory):
+    """ Returns a key sorting the items yielded by discover in their
+    order, from their path relative to the root: the files of a directory
+    come first, by name, then its subdirectories, by name. """
+    names = path.split(os.sep)
+    if is_directory:
+        return tuple((1, name) for name in names)
+    return tuple((1, name) for name in names[:-1]) + ((0, names[-1]),)
+
+
+def discover(root, extensions, marker, recurse, is_excluded, jobs,
+             progress=None, log=None):
+    """ Walks the directory tree below 'root' with a pool of 'jobs' threads
+    and yields (path, is_directory) for every file whose extension is in
+    'extensions' and every directory containing a file named 'marker', as
+    soon as they can be yielded in path order, the walk going on in the
+    background meanwhile: the items of a directory are yielded sorted by
+    name, followed by those of its subdirectories, so that the order does
+    not depend on the threads. Subdirectories whose name is matched by
+    'is_excluded' are pruned. Without 'recurse', only the files of 'root'
+    and its marked subdirectories are yielded. The number of items found
+    so far is added to the total of 'progress', and the directories which
+    cannot be read are reported to 'log'. """
+    pool = ThreadPool(jobs)
+    lock = threading.Lock()
+    # Number of directories submitted but not scanned yet
+    pending = [0]
+    marker = marker.lower()
+
+    def scan(node, depth):
+        path = node['path']
+        items = []
+        children = []
+        try:
+            files, dirs = scan_dir(path, False)
+            names = sorted(name for name, size, mtime in files)
+            if depth > 0 and marker in [name.lower() for name in names]:
+                items.append((path, True))
+            elif depth == 0 or recurse:
+                for name in names:
+                    if os.path.splitext(name)[1].lower() in extensions:
+                        items.append((os.path.join(path, name), False))
+                for name in sorted(dirs):
+                    if not is_excluded(name):
+                        children.append(
+                                submit(os.path.join(path, name), depth + 1))
+        except (IOError, OSError) as e:
+            node['error'] = e
+        finally:
+            node['items'] = items
+            node['children'] = children
+            with lock:
+                if progress is not None:
+                    progress.add_total(len(items))
+                pending[0] -= 1
+                if pending[0] == 0 and progress is not None:
+                    progress.end_total()
+            node['scanned'].set()
+
+    def submit(path, depth):
+        node = {'path': path, 'error': None, 'scanned': threading.Event()}
+        with lock:
+            pending[0] += 1
+        pool.apply_async(scan, (node, depth))
+        return node
+
+    # Directories whose items are still to yield, the next one last
+    stack = [submit(root, 0)]
+    try:
+        while stack:
+            node = stack.pop()
+            while not node['scanned'].wait(1):
+                pass
+            if node['error'] is not None and log is not None:
+                log("Warning: Cannot read the directory '%s' (%s)." % (
+                    node['path'], node['error']))
+            for item in node['items']:
+                yield item
+            stack.extend(reversed(node['children']))
+        pool.close()
+    finally:
+        # Stops the walk if the consumer gives up before its end
+        pool.terminate()
@@ -20,13 +20,20 @@
 
 import os
 import re
+import heapq
+import hashlib
 import shlex
 import subprocess
 import time
 import math
 import sys
+from multiprocessing.pool import ThreadPool
 from xml.sax.saxutils import escape
 
+from mod_fas import feedback_arc_set
+from mod_progress import ModProgress
+from mod_html import write_html_report
+
 __all__ = ["ModGraph", "ModGraphError"]
 
 
@@ -45,8 +52,10 @@ class _FileProps(object):
     # First Morrowind release
     start_time = str_to_time("2002-05-01 12:00:00")
 
-    def __init__(self, sizes, mtimes):
+    def __init__(self, sizes, mtimes, qualities=None):
         self.sizes = sizes
+        # Texture qualities (see mod_headers), if known in both mods
+        self.qualities = qualities
         t0 = str_to_time(mtimes[0])
         t1 = str_to_time(mtimes[1])
         t0 = ((self.start_time - 1) if (t0 <= self.start_time)
@@ -80,15 +89,18 @@ class _ModEdge(object):
     max_size_ratio = 0
     max_mtime_ratio = 0
     max_fc_ratio = 0
+    max_quality_ratio = 0
 
     @classmethod
-    def set_max_ratios(cls, size, mtime, file_count):
+    def set_max_ratios(cls, size, mtime, file_count, quality=1):
         if size > cls.max_size_ratio:
             cls.max_size_ratio = size
         if mtime > cls.max_mtime_ratio:
             cls.max_mtime_ratio = mtime
         if file_count > cls.max_fc_ratio:
             cls.max_fc_ratio = file_count
+        if quality > cls.max_quality_ratio:
+            cls.max_quality_ratio = quality
 
     @classmethod
     def get_normalizing_powers(cls):
@@ -96,7 +108,10 @@ class _ModEdge(object):
         return (
                 num / math.log(cls.max_size_ratio),
                 num / math.log(cls.max_mtime_ratio),
-                num / math.log(cls.max_fc_ratio))
+                num / math.log(cls.max_fc_ratio),
+                # All quality ratios are 1 when the criterion is not used
+                (num / math.log(cls.max_quality_ratio)
+                    if cls.max_quality_ratio > 1 else 1.0))
 
     def __init__(self):
         # Archive data files: {filename = (size in mod1, size in mod2)}
@@ -107,10 +122,21 @@ class _ModEdge(object):
         self.norm_size_ratio = None
         # Normalized modification time ratio of each overlapping files
         self.norm_mtime_ratio = None
+        # Normalized texture quality ratio of each overlapping files
+        self.norm_quality_ratio = 1.0
         # Final score
         self.score = None
         # Does the edge has been removed during the break cycles step?
         self.removed = False
+        # Has the edge been pruned as insignificant before that step?
+        self.pruned = False
+
+    def get_datafiles(self, max_files=0):
+        """ Returns the sorted names of the overlapping files, at most
+        'max_files' of them if not 0. """
+        if max_files and len(self.datafiles) > max_files:
+            return heapq.nsmallest(max_files, self.datafiles.iterkeys())
+        return sorted(self.datafiles.iterkeys())
 
 
 class ModGraph(object):
@@ -122,6 +148,9 @@ class ModGraph(object):
         self.mod_nodes = {}
         self.mod_edges = {}
         self.cfg = cfg
+        self.progress = ModProgress(False)
+        # Insignificant edges left out of the ordering: (mod1, mod2, edge)
+        self.pruned = []
 
     def copy(self):
         copy = ModGraph(self.cfg)
@@ -130,6 +159,24 @@ class ModGraph(object):
             copy.mod_edges[mod] = self.mod_edges[mod].copy()
         return copy
 
+    def copy_ratios(self):
+        """ Returns a copy of the graph whose edges only hold their
+        normalized criterion ratios, to be scored again, and their
+        overlapping files, shared with the graph, to be pruned again. """
+        copy = ModGraph(self.cfg)
+        for mod, props in self.mod_nodes.iteritems():
+            copy.mod_nodes[mod] = _ModProps(props.file_count, props.size)
+        for mod1 in self.mod_edges:
+            for mod2, edge in self.mod_edges[mod1].iteritems():
+                ratios = _ModEdge()
+                ratios.norm_size_ratio = edge.norm_size_ratio
+                ratios.norm_mtime_ratio = edge.norm_mtime_ratio
+                ratios.norm_fc_ratio = edge.norm_fc_ratio
+                ratios.norm_quality_ratio = edge.norm_quality_ratio
+                ratios.datafiles = edge.datafiles
+                copy.add_edge(mod1, mod2, ratios)
+        return copy
+
     def add_node(self, mod, file_count, size):
         self.mod_nodes[mod] = _ModProps(file_count, size)
 
@@ -173,9 +220,10 @@ class ModGraph(object):
         if mod2 not in self.mod_edges[mod1]:
             self.mod_edges[mod1][mod2] = mod_edge
 
-    def add_edge_datafile(self, mod1, mod2, datafile, sizes, mtimes):
+    def add_edge_datafile(self, mod1, mod2, datafile, sizes, mtimes,
+            qualities=None):
         self.add_edge(mod1, mod2)
-        fileprops = _FileProps(sizes, mtimes)
+        fileprops = _FileProps(sizes, mtimes, qualities)
         self.mod_edges[mod1][mod2].datafiles[datafile] = fileprops
 
     def del_edge(self, mod1, mod2):
@@ -183,6 +231,16 @@ class ModGraph(object):
         if not self.mod_edges[mod1]:
             del(self.mod_edges[mod1])
 
+    def del_edge_datafile(self, mod1, mod2, datafile):
+        """ Removes an overlapping data file from an edge, and the edge
+        if it has no data file left. """
+        edge = self.mod_edges.get(mod1, {}).get(mod2)
+        if edge is None or datafile not in edge.datafiles:
+            return
+        del edge.datafiles[datafile]
+        if not edge.datafiles:
+            self.del_edge(mod1, mod2)
+
     def set_edge_props(self):
         """ Calculates the score factors for each couple of mods (mod1, mod2).
         Such factors are similarity functions used to determine whether the
@@ -194,6 +252,8 @@ class ModGraph(object):
             for mod2 in self.mod_edges[mod1]:
                 norm_size_ratio = 1.0
                 norm_mtime_ratio = 1.0
+                norm_quality_ratio = 1.0
+                quality_count = 0
                 edge = self.mod_edges[mod1][mod2]
                 datafiles = edge.datafiles
                 # For each overlapping file between mod1 and mod2
@@ -205,6 +265,11 @@ class ModGraph(object):
                     # Average modification time ratio
                     mtimes = datafiles[file_props].mtimes
                     norm_mtime_ratio *= float(mtimes[0]) / mtimes[1]
+                    # Average texture quality ratio
+                    qualities = datafiles[file_props].qualities
+                    if qualities:
+                        norm_quality_ratio *= float(qualities[0]) / qualities[1]
+                        quality_count += 1
 
                 # The size and mtime factors are now applied a
                 # nth root as they have been multiplied n times.
@@ -216,6 +281,14 @@ class ModGraph(object):
                 mtime_ratio = norm_mtime_ratio ** (1.0 / len(datafiles))
                 edge.norm_mtime_ratio = mtime_ratio
 
+                # Only textures whose header could be read in both mods
+                # are taken into account.
+                quality_ratio = 1.0
+                if quality_count:
+                    quality_ratio = min(sys.float_info.max,
+                            norm_quality_ratio) ** (1.0 / quality_count)
+                edge.norm_quality_ratio = quality_ratio
+
                 # File count ratio: Mods with fewer files are
                 # supposed to be more specialized and thus should take
                 # precedence over more populated ones.
@@ -226,10 +299,10 @@ class ModGraph(object):
 
                 # Update maximum factor values for future normalizing
                 _ModEdge.set_max_ratios(
-                        size_ratio, mtime_ratio, fc_ratio)
+                        size_ratio, mtime_ratio, fc_ratio, quality_ratio)
 
         # Now normalize the factors
-        size_power, mtime_power, file_count_power = (
+        size_power, mtime_power, file_count_power, quality_power = (
                 _ModEdge.get_normalizing_powers())
         for mod1 in self.mod_edges:
             for mod2 in self.mod_edges[mod1]:
@@ -237,6 +310,8 @@ class ModGraph(object):
                 edge.norm_size_ratio = edge.norm_size_ratio ** size_power
                 edge.norm_mtime_ratio = edge.norm_mtime_ratio ** mtime_power
                 edge.norm_fc_ratio = edge.norm_fc_ratio ** file_count_power
+                edge.norm_quality_ratio = (
+                        edge.norm_quality_ratio ** quality_power)
 
     def set_directions(self):
         """ Removes edges for mod1 < mod2 to produce a directed graph. """
@@ -253,10 +328,13 @@ class ModGraph(object):
                 mtime_power = self.cfg.mtime_coeff
                 # File Count (specificity) coefficient
                 fc_power = self.cfg.fc_coeff
+                # Texture Quality coefficient
+                quality_power = self.cfg.quality_coeff
                 # Final score
                 score = (edge.norm_size_ratio ** size_power *
                         edge.norm_mtime_ratio ** mtime_power *
                         edge.norm_fc_ratio ** fc_power *
+                        edge.norm_quality_ratio ** quality_power *
                         coeff)
 
                 # Does the configuration file specify that
@@ -274,93 +352,128 @@ class ModGraph(object):
                 else:
                     self.mod_edges[mod1][mod2].score = score
 
+    def prune_edges(self):
+        """ Removes the insignificant edges before the cycles are broken:
+        those with fewer overlapping files than 'prune_min_files', with
+        fewer overlapping bytes in the overwritten mod than
+        'prune_min_bytes', or whose score is below 1 + 'prune_score_band',
+        ie. between mods about as likely to overwrite each other. The
+        precedences forced by the configuration are kept. The pruned edges
+        are only taken into account by order_pruned. """
+        min_files = self.cfg.option['prune_min_files']
+        min_bytes = self.cfg.option['prune_min_bytes']
+        min_score = 1 + self.cfg.option['prune_score_band']
+        self.pruned = []
+        if not (min_files or min_bytes or min_score > 1):
+            return
+        count = 0
+        for mod1 in self.mod_edges.keys():
+            for mod2, edge in self.mod_edges[mod1].items():
+                count += 1
+                if self.cfg.is_greater(mod1, mod2) != 0:
+                    continue
+                if (len(edge.datafiles) < min_files or edge.score < min_score
+                        or (min_bytes and sum(
+                            props.sizes[1] for props
+                            in edge.datafiles.itervalues()) < min_bytes)):
+                    self.del_edge(mod1, mod2)
+                    edge.pruned = True
+                    self.pruned.append((mod1, mod2, edge))
+        self.cfg.log("\t- Pruned %d insignificant overlap(s) out of %d." % (
+            len(self.pruned), count))
+
+    def order_pruned(self):
+        """ Adds the pruned edges back to the graph, strongest first, and
+        returns the topological sorting of the completed graph. A pruned
+        edge which would close a cycle with the edges already in the graph
+        is discarded like the edges breaking the cycles (see break_cycles),
+        and added back by restore_cycles. """
+        discarded = 0
+        for mod1, mod2, edge in sorted(self.pruned,
+                key=lambda pruned: (-pruned[2].score, pruned[0], pruned[1])):
+            if self.has_path(mod2, mod1):
+                edge.removed = True
+                self.FAS.append((mod1, mod2, edge))
+                discarded += 1
+            else:
+                self.add_edge(mod1, mod2, edge)
+        if discarded:
+            self.cfg.log("\t- Discarded %d pruned overlap(s) closing a "\
+                    "cycle." % discarded, False)
+        return self.tsort_graph()
+
+    def has_path(self, mod1, mod2):
+        """ Tells whether mod2 can be reached from mod1 in the graph. """
+        seen = set([mod1])
+        todo = [mod1]
+        while todo:
+            mod = todo.pop()
+            if mod == mod2:
+                return True
+            for succ in self.mod_edges.get(mod, ()):
+                if succ not in seen:
+                    seen.add(succ)
+                    todo.append(succ)
+        return False
+
+    def without_pruned(self):
+        """ Returns a copy of the graph without its pruned edges nor the
+        mods only connected through them, or the graph itself if none of
+        its edges is pruned. """
+        if not any(edge.pruned for _, _, edge in self.iter_edges()):
+            return self
+        graph = ModGraph(self.cfg)
+        for mod1, mod2, edge in self.iter_edges():
+            if not edge.pruned:
+                graph.add_edge(mod1, mod2, edge)
+                graph.mod_nodes[mod1] = self.mod_nodes[mod1]
+                graph.mod_nodes[mod2] = self.mod_nodes[mod2]
+        return graph
+
     def break_cycles(self):
         """ Breaks precedence cycles (eg. mod1 > mod2 > mod3 > mod1), if there
-        is any, by discarding a minimum set of precedences.
-
-        Implements the algorithm described in "Combinatorial Algorithms for
-        Feedback Problems in Directed Graphs" by Camil Demetrescu and
-        Irene Finocchi: "Given a weighted directed graph G = (V, A),
-        the minimum feedback arc set problem consists of finding
-        a minimum weight set of arcs A' ⊆ A such that the directed graph
-        (V, A\A') is acyclic."
+        is any, by discarding a minimum set of precedences: "Given a weighted
+        directed graph G = (V, A), the minimum feedback arc set problem
+        consists of finding a minimum weight set of arcs A' ⊆ A such that
+        the directed graph (V, A\A') is acyclic."
 
         The weights here are the previously calculated scores for each couple of
-        mod, ie. for each edge of the graph.
+        mod, ie. for each edge of the graph. Each strongly connected component
+        of the graph is given to the configured feedback arc set solver
+        (see mod_fas).
         """
-        def get_cycle():
-            unvisited = self.mod_nodes.keys()
-            cycle = []
-            # Depth first traversal. Build a cycle, or None.
-            # Returns True when a cycle is found, False otherwise
-            def traverse_graph():
-                if len(cycle) == 0:
-                    if len(unvisited) == 0:
-                        return False
-                    cycle.append(unvisited.pop())
-                cur_node = cycle[-1]
-                if cur_node in self.mod_edges:
-                    for n in self.mod_edges[cur_node]:
-                        if n in cycle:
-                            # Remove the tail before the cycle
-                            for j in range(cycle.index(n)):
-                                cycle.pop(0)
-                            return True
-                        elif n in unvisited:
-                            cycle.append(n)
-                            unvisited.pop(unvisited.index(n))
-                            if traverse_graph():
-                                return True
-                cycle.pop()
-                return False
-            while len(unvisited) > 0:
-                if traverse_graph():
-                    return cycle
-            return None
-
-        def get_min_edge_value(cycle):
-            minval = -1
-            for i in range(len(cycle) - 1):
-                e = self.mod_edges[cycle[i]][cycle[i + 1]].val
-                if e < minval or minval == -1:
-                    minval = e
-            return minval
-
-        def remove_min_edges(cycle, val):
-            # Feedback Arc Set
-            FAS = []
-            for i in range(len(cycle) - 1):
-                n1 = cycle[i]
-                n2 = cycle[i + 1]
-                self.mod_edges[n1][n2].val -= val
-                if self.mod_edges[n1][n2].val == 0:
-                    FAS.append((n1, n2, self.mod_edges[n1][n2]))
-                    self.del_edge(n1, n2)
-            return FAS
-
-        for mod1 in self.mod_edges:
-            for mod2 in self.mod_edges[mod1]:
-                val = self.mod_edges[mod1][mod2].score
-                self.mod_edges[mod1][mod2].val = round(val * 1000)
-
-        FAS = []
-        cycle = get_cycle()
-        while cycle is not None:
-            minval = get_min_edge_value(cycle)
-            FAS.extend(remove_min_edges(cycle, minval))
-            cycle = get_cycle()
-
+        tstart = time.time()
+        solver = self.cfg.option['fas_solver']
         self.FAS = []
-        for edge in FAS:
-            self.add_edge(*edge)
-            if get_cycle() is not None:
-                self.del_edge(edge[0], edge[1])
-                edge[2].removed = True
-                self.FAS.append(edge)
+        sccs = [scc for scc in self.get_sccs() if len(scc) > 1]
+        self.progress.start('cycles', 'mods', sum(len(scc) for scc in sccs))
+        for scc in sccs:
+            nodes = set(scc)
+            weights = {}
+            # The solvers break ties in the iteration order of the weights,
+            # which is made independent of the order the edges were added
+            # and removed in (eg. with the pipeline option) by inserting the
+            # mods in sorted order.
+            for mod1 in sorted(scc):
+                edges = self.mod_edges.get(mod1, {})
+                weights[mod1] = dict((mod2, edges[mod2].score)
+                                     for mod2 in sorted(edges)
+                                     if mod2 in nodes)
+            for mod1, mod2 in feedback_arc_set(weights, solver,
+                    self.cfg.option['fas_exact_max_nodes']):
+                edge = self.mod_edges[mod1][mod2]
+                self.del_edge(mod1, mod2)
+                edge.removed = True
+                self.FAS.append((mod1, mod2, edge))
+            self.progress.update(len(scc), cycles=1)
+        self.progress.finish()
 
         if len(self.FAS) > 0:
             self.cfg.log("Discarded %d overlap(s) in order to break cycling "\
                     "overlap precedence." % len(self.FAS))
+            self.cfg.log("\t- Total discarded score: %.2f (%s solver, %.2fs)"
+                    % (sum(edge.score for n1, n2, edge in self.FAS),
+                        solver, time.time() - tstart))
 
     def tsort_graph(self):
         """ Constructs a topological sorting of the graph
@@ -416,7 +529,20 @@ class ModGraph(object):
         for mod in mod_overlapped_files:
             self.set_overlapped_count(mod, len(mod_overlapped_files[mod]))
 
+    def iter_edges(self):
+        """ Yields the (mod1, mod2, edge) of every edge, sorted by mod names,
+        as listed by the reports. """
+        for mod1 in sorted(self.mod_edges.iterkeys()):
+            for mod2 in sorted(self.mod_edges[mod1].iterkeys()):
+                yield mod1, mod2, self.mod_edges[mod1][mod2]
+
     def __str__(self):
+        return ''.join(self.iter_report())
+
+    def iter_report(self, max_files=20):
+        """ Generates the text report of the graph, chunk by chunk, so it can
+        be streamed to a file. At most 'max_files' overlapping files are
+        listed per edge, or all of them if 'max_files' is 0. """
 
         def str_size(size):
             if size < 10**3:
@@ -430,6 +556,8 @@ class ModGraph(object):
         col_fs2 = 5 # max: xxxX
         col_ns = 6 # max: xx.xx
         col_nt = 6 # max: xx.xx
+        # Texture quality column, only shown if the criterion is used
+        col_nq = 6 if self.cfg.quality_coeff > 0 else 0 # max: xx.xx
         col_fc_ratio = 8 # max: xxx.xx
         col_score = 9 # max: xxxx.xx
         col_fc = 6 # max: xxxx
@@ -449,11 +577,11 @@ class ModGraph(object):
                 max(len(max_source_mod),
                     tab + len(max_target_mod)))
         col_file = mod_name_max_length
-        all_col = (col_file + col_fs1 + col_fs2 + col_ns + col_nt +
+        all_col = (col_file + col_fs1 + col_fs2 + col_ns + col_nt + col_nq +
                 col_fc_ratio + col_score + col_fc + col_ofc + col_size)
         sep = '%s\n' % ('-' * all_col)
 
-        buff = ["*** Graph of Mod Install Precedence ***\n\n",
+        yield ''.join(["*** Graph of Mod Install Precedence ***\n\n",
                 "Each mod name is a node.\n",
                 "Edge directions are from unindented lines ",
                 "to indented ones:\n\n",
@@ -467,12 +595,14 @@ class ModGraph(object):
                 "%sNSR = Normalized Size Ratio of overlapping files\n" % stab,
                 "%sNTR = Normalized modification Time Ratio of"\
                         " overlapping files\n" % stab,
+                ("%sNQR = Normalized texture Quality Ratio of overlapping"\
+                        " files\n" % stab) if col_nq else "",
                 "%sFCR = File Count Ratio of all files\n" % stab,
                 "%sScore = NS * FCR\n" % stab,
                 "Values based on the whole mod:\n",
                 "%sFC = File Count\n" % stab,
                 "%sOFC = Overlapped File Count\n" % stab,
-                "%sSize = Total (uncompressed) Size of the mod\n\n" % stab]
+                "%sSize = Total (uncompressed) Size of the mod\n\n" % stab])
         titles = ''.join([
             sep,
             "Mod Filenames and Overlapping Files".ljust(col_file),
@@ -480,57 +610,67 @@ class ModGraph(object):
             "FS2".rjust(col_fs2),
             "NSR".rjust(col_ns),
             "NTR".rjust(col_nt),
+            "NQR".rjust(col_nq) if col_nq else "",
             "FCR".rjust(col_fc_ratio),
             "Score".rjust(col_score),
             "FC".rjust(col_fc),
             "OFC".rjust(col_ofc),
             "Size".rjust(col_size),
             "\n%s" % sep])
-        buff.append(titles)
+        yield titles
         lines = 0
-        for mod1 in sorted(self.mod_edges.iterkeys()):
-            mod1_name = self.cfg.clean_mod_num_prefix(mod1)
-            if lines > 40:
-                buff.append(titles)
-                lines = 0
-            buff.append('%s%s%s%s\n' % (
-                mod1_name.ljust(col_file + col_fs1 + col_fs2 + col_ns +
-                    col_nt + col_fc_ratio + col_score),
-                str(self.mod_nodes[mod1].file_count).rjust(col_fc),
-                str(self.mod_nodes[mod1].overlapped_count).rjust(col_ofc),
-                str_size(self.mod_nodes[mod1].size).rjust(col_size)))
+        current = None
+        for mod1, mod2, edge in self.iter_edges():
+            if mod1 != current:
+                current = mod1
+                mod1_name = self.cfg.clean_mod_num_prefix(mod1)
+                if lines > 40:
+                    yield titles
+                    lines = 0
+                yield ('%s%s%s%s\n' % (
+                    mod1_name.ljust(col_file + col_fs1 + col_fs2 + col_ns +
+                        col_nt + col_nq + col_fc_ratio + col_score),
+                    str(self.mod_nodes[mod1].file_count).rjust(col_fc),
+                    str(self.mod_nodes[mod1].overlapped_count).rjust(col_ofc),
+                    str_size(self.mod_nodes[mod1].size).rjust(col_size)))
+                lines += 1
+            mod2_name = self.cfg.clean_mod_num_prefix(mod2)
+            if edge.removed:
+                yield "(discarded overlap:)\n"
+            elif edge.pruned:
+                yield "(pruned overlap:)\n"
+            yield ('%s%s%s%s%s%s%s%s%s%s\n' % (
+                stab,
+                mod2_name.ljust(col_file + col_fs1 + col_fs2 - tab),
+                ("%.2f" % round(edge.norm_size_ratio, 2)).rjust(col_ns),
+                ("%.2f" % round(edge.norm_mtime_ratio, 2)).rjust(col_nt),
+                ("%.2f" % round(edge.norm_quality_ratio, 2)).rjust(col_nq)
+                    if col_nq else "",
+                ("%.2f" % round(edge.norm_fc_ratio,
+                                2)).rjust(col_fc_ratio),
+                ("%.2f" % round(edge.score, 2)).rjust(col_score),
+                str(self.mod_nodes[mod2].file_count).rjust(col_fc),
+                str(self.mod_nodes[mod2].overlapped_count).rjust(col_ofc),
+                str_size(self.mod_nodes[mod2].size).rjust(col_size)))
             lines += 1
-            for mod2 in sorted(self.mod_edges[mod1].iterkeys()):
-                mod2_name = self.cfg.clean_mod_num_prefix(mod2)
-                edge = self.mod_edges[mod1][mod2]
-                if edge.removed:
-                    buff.append("(discarded overlap:)\n")
-                buff.append('%s%s%s%s%s%s%s%s%s\n' % (
-                    stab,
-                    mod2_name.ljust(col_file + col_fs1 + col_fs2 - tab),
-                    ("%.2f" % round(edge.norm_size_ratio, 2)).rjust(col_ns),
-                    ("%.2f" % round(edge.norm_mtime_ratio, 2)).rjust(col_nt),
-                    ("%.2f" % round(edge.norm_fc_ratio,
-                                    2)).rjust(col_fc_ratio),
-                    ("%.2f" % round(edge.score, 2)).rjust(col_score),
-                    str(self.mod_nodes[mod2].file_count).rjust(col_fc),
-                    str(self.mod_nodes[mod2].overlapped_count).rjust(col_ofc),
-                    str_size(self.mod_nodes[mod2].size).rjust(col_size)))
+            datafiles = edge.get_datafiles(max_files)
+            for datafile in datafiles:
+                sizes = edge.datafiles[datafile].sizes
+                yield ('%s%s%s%s\n' % (
+                    stab * 2,
+                    datafile.ljust(col_file - 2 * tab),
+                    str_size(sizes[0]).rjust(col_fs1),
+                    str_size(sizes[1]).rjust(col_fs2)))
+                lines += 1
+            if len(edge.datafiles) > len(datafiles):
+                yield "%s[...]\n" % (stab * 2)
                 lines += 1
-                for datafile in sorted(edge.datafiles.iterkeys())[:20]:
-                    sizes = edge.datafiles[datafile].sizes
-                    buff.append('%s%s%s%s\n' % (
-                        stab * 2,
-                        datafile.ljust(col_file - 2 * tab),
-                        str_size(sizes[0]).rjust(col_fs1),
-                        str_size(sizes[1]).rjust(col_fs2)))
-                    lines += 1
-                if len(edge.datafiles) > 20:
-                    buff.append('%s[...]\n' % (stab * 2))
-                    lines += 1
-        return ''.join(buff)
-
-    def to_graphviz(self):
+
+    def to_graphviz(self, mods=None, sccs=None):
+        """ Returns the Graphviz representation of the graph, restricted to
+        the nodes 'mods' if given. Mods being part of a same precedence
+        cycle (strongly connected component) are grouped into a cluster,
+        'sccs' being the precomputed components if given. """
         def to_node(path):
             return ('_%s' %
                     re.sub(
@@ -566,10 +706,26 @@ class ModGraph(object):
                 xml_label.replace("\n","<br/>"),
                 coeff_label))
 
+        if mods is None:
+            mods = set(self.mod_nodes)
         _str = ["digraph G {\n"]
-        for mod in self.mod_nodes:
-            _str.append(to_label(mod))
+        clustered = set()
+        if sccs is None:
+            sccs = self.get_sccs()
+        sccs = [scc for scc in sccs if len(scc) > 1 and scc[0] in mods]
+        for i, scc in enumerate(sccs):
+            _str.append("\tsubgraph cluster_%d {\n" % (i + 1))
+            _str.append("\tstyle=dashed;\n\tcolor=grey;\n")
+            for mod in sorted(scc):
+                _str.append(to_label(mod))
+            _str.append("\t}\n")
+            clustered.update(scc)
+        for mod in mods:
+            if mod not in clustered:
+                _str.append(to_label(mod))
         for mod1 in self.mod_edges:
+            if mod1 not in mods:
+                continue
             node1 = to_node(mod1)
             for mod2 in self.mod_edges[mod1]:
                 node2 = to_node(mod2)
@@ -593,16 +749,171 @@ class ModGraph(object):
 
         return ''.join(_str)
 
+    def get_sccs(self):
+        """ Returns the strongly connected components of the graph, using an
+        iterative version of Tarjan's algorithm. """
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        sccs = []
+        for root in self.mod_nodes:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.mod_edges.get(root, ())))]
+            while work:
+                mod, successors = work[-1]
+                for succ in successors:
+                    if succ not in index:
+                        index[succ] = lowlink[succ] = len(index)
+                        stack.append(succ)
+                        on_stack.add(succ)
+                        work.append(
+                                (succ, iter(self.mod_edges.get(succ, ()))))
+                        break
+                    elif succ in on_stack:
+                        lowlink[mod] = min(lowlink[mod], index[succ])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[mod])
+                    if lowlink[mod] == index[mod]:
+                        scc = []
+                        while True:
+                            node = stack.pop()
+                            on_stack.discard(node)
+                            scc.append(node)
+                            if node == mod:
+                                break
+                        sccs.append(scc)
+        return sccs
+
+    def get_weak_components(self):
+        """ Returns the weakly connected components of the graph,
+        largest first. """
+        neighbours = dict((mod, set()) for mod in self.mod_nodes)
+        for mod1 in self.mod_edges:
+            for mod2 in self.mod_edges[mod1]:
+                neighbours[mod1].add(mod2)
+                neighbours[mod2].add(mod1)
+        components = []
+        unvisited = set(self.mod_nodes)
+        while unvisited:
+            mod = unvisited.pop()
+            component = set([mod])
+            todo = [mod]
+            while todo:
+                for other in neighbours[todo.pop()]:
+                    if other in unvisited:
+                        unvisited.discard(other)
+                        component.add(other)
+                        todo.append(other)
+            components.append(component)
+        return sorted(components, key=lambda c: (-len(c), min(c)))
+
+    def render_graph(self, dotfile, pdffile):
+        """ Runs the dot tool on a file, killing it if it runs longer than
+        the configured timeout. Returns the (return code, time) pair, the
+        return code being None on timeout. The PDF file is only replaced
+        if the rendering succeeds, so that an incomplete one is never
+        taken as up to date. """
+        tstart = time.time()
+        timeout = self.cfg.option['dot_timeout']
+        tmpfile = '%s.tmp' % pdffile
+        dotcmd = ('%s -Tpdf "%s" -o "%s"' % (
+            self.cfg.path['dot'], dotfile, tmpfile))
+        dotproc = subprocess.Popen(shlex.split(dotcmd),
+                stdout=self.cfg.log_fd, stderr=self.cfg.log_fd)
+        ret = None
+        while dotproc.poll() is None:
+            if timeout and time.time() - tstart > timeout:
+                dotproc.kill()
+                dotproc.wait()
+                break
+            time.sleep(0.05)
+        else:
+            ret = dotproc.returncode
+        if ret == 0:
+            if os.path.exists(pdffile):
+                os.remove(pdffile)
+            os.rename(tmpfile, pdffile)
+        elif os.path.exists(tmpfile):
+            os.remove(tmpfile)
+        return ret, time.time() - tstart
+
     def write_graph_files(self, filename):
+        """ Writes the text report, the HTML report if enabled and, if the
+        dot tool is available, one Graphviz file per weakly connected
+        component of the graph, then renders them in parallel. Components
+        whose Graphviz content did not change since the previous run are
+        not rendered again. """
         with open('%s.txt' % filename,'w') as stream:
-            stream.write(str(self))
-        if 'dot' in self.cfg.path:
-            with open('%s.dot' % filename,'w') as stream:
-                stream.write(self.to_graphviz())
-            dotcmd = ('%s -Tpdf "%s.dot" -o "%s.pdf"' % (
-                self.cfg.path['dot'], filename, filename))
-            dotargs = shlex.split(dotcmd)
-            subprocess.Popen(dotargs, stdout=self.cfg.log_fd,
-                    stderr=self.cfg.log_fd)
-
-
+            stream.writelines(
+                    self.iter_report(self.cfg.option['report_max_files']))
+        if self.cfg.option['html_report']:
+            write_html_report(self, filename)
+        if 'dot' not in self.cfg.path:
+            return
+
+        # Pruned overlaps are left out of the layouts
+        graph = self.without_pruned()
+        components = graph.get_weak_components()
+        if len(components) == 1:
+            basenames = [filename]
+        else:
+            basenames = ['%s_%03d' % (filename, i + 1)
+                         for i in range(len(components))]
+        sccs = graph.get_sccs()
+        renders = []
+        for basename, mods in zip(basenames, components):
+            content = graph.to_graphviz(mods, sccs)
+            dotfile = '%s.dot' % basename
+            pdffile = '%s.pdf' % basename
+            if (os.path.exists(dotfile) and os.path.exists(pdffile) and
+                    os.path.getmtime(pdffile) >= os.path.getmtime(dotfile)):
+                with open(dotfile, 'rb') as stream:
+                    old_hash = hashlib.md5(stream.read()).digest()
+                if old_hash == hashlib.md5(content).digest():
+                    continue
+            with open(dotfile, 'wb') as stream:
+                stream.write(content)
+            renders.append((dotfile, pdffile, len(mods)))
+
+        # Remove the files left over by a previous run: the component
+        # files, and the single graph files if the graph is now split.
+        pattern = re.compile('%s(_\\d{3})?\\.(dot|pdf)$' %
+                re.escape(os.path.basename(filename)))
+        dirname = os.path.dirname(filename)
+        current = set(os.path.basename(b) for b in basenames)
+        for name in os.listdir(dirname):
+            if (pattern.match(name) and
+                    os.path.splitext(name)[0] not in current):
+                os.remove(os.path.join(dirname, name))
+
+        skipped = len(components) - len(renders)
+        if skipped:
+            self.cfg.log("\t- %d graph file(s) unchanged, not rendered again."
+                    % skipped, False)
+        if not renders:
+            return
+
+        pool = ThreadPool(min(self.cfg.option['dot_jobs'], len(renders)))
+        def render(args):
+            return args, self.render_graph(args[0], args[1])
+        for (dotfile, pdffile, size), (ret, elapsed) in pool.imap_unordered(
+                render, renders):
+            if ret is None:
+                self.cfg.log("\t- Rendering of '%s' (%d mods) timed out after"\
+                        " %.2fs." % (dotfile, size, elapsed))
+            elif ret != 0:
+                self.cfg.log("\t- Rendering of '%s' (%d mods) failed with "\
+                        "code %d." % (dotfile, size, ret))
+            else:
+                self.cfg.log("\t- Rendered '%s' (%d mods) in %.2fs." % (
+                    pdffile, size, elapsed))
+        pool.close()
+        pool.join()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Parsers for the headers of Morrowind data files. They only need the
+first bytes of a file, so that files can be read without being fully
+extracted from their archive.
+"""
+
+import math
+import struct
+
+__all__ = ["texture_extensions", "texture_header_size", "texture_quality",
+           "parse_texture_header", "plugin_extensions", "plugin_header_size",
+           "plugin_record_size", "parse_plugin_masters",
+           "bsa_header_size", "parse_bsa_header", "parse_bsa_records"]
+
+texture_extensions = set(['dds', 'tga', 'bmp'])
+# Number of bytes needed to parse the header of any texture format
+texture_header_size = 128
+
+
+def parse_texture_header(extension, data):
+    """ Returns the (width, height, mipmap count) of a texture from the
+    first bytes of its file, or None if they cannot be parsed. """
+    try:
+        if extension == 'dds':
+            if data[:4] != 'DDS ':
+                return None
+            height, width = struct.unpack_from('<2I', data, 12)
+            mipmaps = struct.unpack_from('<I', data, 28)[0]
+            return (width, height, max(1, mipmaps))
+        elif extension == 'tga':
+            width, height = struct.unpack_from('<2H', data, 12)
+            return (width, height, 1)
+        elif extension == 'bmp':
+            if data[:2] != 'BM':
+                return None
+            width, height = struct.unpack_from('<2i', data, 18)
+            return (width, abs(height), 1)
+    except struct.error:
+        return None
+    return None
+
+
+def texture_quality(header):
+    """ Quality of a texture: the square root of its resolution, weighted by
+    the completeness of its mipmap chain (x1 without mipmaps, x2 with the
+    full chain), or None if the header is unknown or invalid. """
+    if not header:
+        return None
+    width, height, mipmaps = header
+    if width <= 0 or height <= 0:
+        return None
+    full_chain = int(math.log(max(width, height), 2)) + 1
+    return ((width * height) ** 0.5 *
+            (1.0 + float(min(mipmaps, full_chain) - 1) / max(1, full_chain - 1)))
+
+
+plugin_extensions = set(['esp', 'esm'])
+# Number of bytes read first from a plugin: enough for the TES3 record of
+# plugins with a few dozens of masters.
+plugin_header_size = 4096
+
+
+def plugin_record_size(data):
+    """ Returns the size of the TES3 header record of a plugin, including
+    its own header, or None if the data is not a TES3 plugin. """
+    if len(data) < 16 or data[:4] != 'TES3':
+        return None
+    return 16 + struct.unpack_from('<I', data, 4)[0]
+
+
+def parse_plugin_masters(data):
+    """ Returns the list of the master files (lower case names) of a TES3
+    plugin from its header record, or None if it cannot be parsed. """
+    record_size = plugin_record_size(data)
+    if record_size is None or len(data) < record_size:
+        return None
+    masters = []
+    pos = 16
+    try:
+        while pos + 8 <= record_size:
+            name, size = struct.unpack_from('<4sI', data, pos)
+            pos += 8
+            if name == 'MAST':
+                masters.append(data[pos:pos + size].split('\0', 1)[0].lower())
+            pos += size
+    except struct.error:
+        return None
+    return masters
+
+
+# TES3 BSA header: version, hash table offset, file count
+bsa_header_size = 12
+
+
+def parse_bsa_header(data):
+    """ Returns the (size of the file records and names table, file count)
+    of a TES3 BSA archive from its header, or None if it is not one. """
+    if len(data) < bsa_header_size:
+        return None
+    version, hash_offset, file_count = struct.unpack_from('<3I', data)
+    if version != 0x100:
+        return None
+    return hash_offset, file_count
+
+
+def parse_bsa_records(data, file_count):
+    """ Returns the list of the (path, size, offset) of the files of a TES3
+    BSA archive from its file records and names table (the data following
+    its header), or None if it cannot be parsed. """
+    try:
+        records = struct.unpack_from('<%dI' % (2 * file_count), data)
+        name_offsets = struct.unpack_from('<%dI' % file_count, data,
+                                          8 * file_count)
+    except struct.error:
+        return None
+    names_start = 12 * file_count
+    files = []
+    for i in range(file_count):
+        start = names_start + name_offsets[i]
+        end = data.find('\0', start)
+        if end == -1:
+            return None
+        files.append((data[start:end].lower(), records[2 * i],
+                      records[2 * i + 1]))
+    return files
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" State of the install order computed by a run, saved to be compared
+with the one of the next run.
+
+A state is a JSON document holding the ordered list of the overlapping
+mods, and the (winner, loser, score) of every overlap and of the discarded
+ones. Mods are named without their numerical prefix, which changes
+between runs as mods get renamed. Names are saved as latin-1 decoded
+strings, as in the partial indexes, whatever their encoding.
+"""
+
+import json
+
+__all__ = ["state_version", "make_state", "save_state", "load_state",
+           "diff_states", "iter_diff"]
+
+state_version = 1
+
+
+def make_state(order, edges, discarded, name=lambda mod: mod):
+    """ Returns the state of an install order: 'order' is the list of the
+    ordered mods, 'edges' and 'discarded' lists of (winner, loser, score)
+    of the overlaps and of the discarded ones, 'name' giving the name saved
+    for a mod. """
+    return {
+        'version': state_version,
+        'order': [name(mod) for mod in order],
+        'edges': [[name(mod1), name(mod2), round(score, 4)]
+                  for mod1, mod2, score in edges],
+        'discarded': [[name(mod1), name(mod2), round(score, 4)]
+                      for mod1, mod2, score in discarded],
+    }
+
+
+def save_state(filename, state):
+    with open(filename, 'w') as stream:
+        json.dump(state, stream, separators=(',', ':'), encoding='latin-1')
+
+
+def load_state(filename):
+    """ Returns the state saved in a file, or None if there is none or it
+    has been saved by another version of BIO. """
+    try:
+        with open(filename) as stream:
+            state = json.load(stream)
+    except (IOError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != state_version:
+        return None
+    state['order'] = [mod.encode('latin-1') for mod in state['order']]
+    for key in ('edges', 'discarded'):
+        state[key] = [[mod1.encode('latin-1'), mod2.encode('latin-1'), score]
+                      for mod1, mod2, score in state[key]]
+    return state
+
+
+def diff_states(old, new):
+    """ Compares two states in linear time, and returns a dictionary of:
+    - 'moved': (mod, old position, new position, shift) of the mods whose
+      position among the mods of both orders changed, the shift being
+      positive for mods installed later (so overriding more mods),
+    - 'added', 'removed': the mods of one order only,
+    - 'flipped': (winner, loser, old score, new score) of the overlaps
+      whose direction changed,
+    - 'discarded', 'restored': (winner, loser, score) of the overlaps
+      discarded by the new run only, or by the old run only. """
+    old_order = old['order']
+    new_order = new['order']
+    old_mods = set(old_order)
+    new_mods = set(new_order)
+    # Positions among the mods common to both orders, so that mods added
+    # or removed do not make the following ones look moved.
+    old_rank = dict((mod, i) for i, mod in
+                    enumerate(m for m in old_order if m in new_mods))
+    new_rank = dict((mod, i) for i, mod in
+                    enumerate(m for m in new_order if m in old_mods))
+    old_pos = dict((mod, i) for i, mod in enumerate(old_order))
+    moved = [(mod, old_pos[mod] + 1, i + 1, new_rank[mod] - old_rank[mod])
+             for i, mod in enumerate(new_order)
+             if mod in old_rank and new_rank[mod] != old_rank[mod]]
+
+    old_edges = dict(((mod1, mod2), score)
+                     for mod1, mod2, score in old['edges'])
+    flipped = [(mod1, mod2, old_edges[(mod2, mod1)], score)
+               for mod1, mod2, score in new['edges']
+               if (mod2, mod1) in old_edges]
+
+    old_discarded = set((mod1, mod2) for mod1, mod2, _ in old['discarded'])
+    new_discarded = set((mod1, mod2) for mod1, mod2, _ in new['discarded'])
+    return {
+        'moved': moved,
+        'added': [mod for mod in new_order if mod not in old_mods],
+        'removed': [mod for mod in old_order if mod not in new_mods],
+        'flipped': flipped,
+        'discarded': [tuple(edge) for edge in new['discarded']
+                      if (edge[0], edge[1]) not in old_discarded],
+        'restored': [tuple(edge) for edge in old['discarded']
+                     if (edge[0], edge[1]) not in new_discarded],
+    }
+
+
+def iter_diff(diff):
+    """ Generates the text report of a diff between two states. """
+    if not any(diff.itervalues()):
+        yield 'The install order did not change.\n'
+        return
+    if diff['moved']:
+        yield 'Moved mods (old position -> new position, shift):\n\n'
+        for mod, old_pos, new_pos, shift in diff['moved']:
+            yield '\t%4d -> %4d  %+4d  %s\n' % (old_pos, new_pos, shift, mod)
+        yield '\n'
+    if diff['added']:
+        yield 'New overlapping mods:\n\n'
+        for mod in diff['added']:
+            yield '\t%s\n' % mod
+        yield '\n'
+    if diff['removed']:
+        yield 'Mods no longer overlapping:\n\n'
+        for mod in diff['removed']:
+            yield '\t%s\n' % mod
+        yield '\n'
+    if diff['flipped']:
+        yield 'Flipped overlaps (winner > loser, old score -> new score):\n\n'
+        for mod1, mod2, old_score, score in diff['flipped']:
+            yield '\t%s > %s  (%.2f -> %.2f)\n' % (mod1, mod2, old_score,
+                                                   score)
+        yield '\n'
+    if diff['discarded']:
+        yield 'Newly discarded overlaps (winner > loser, score):\n\n'
+        for mod1, mod2, score in diff['discarded']:
+            yield '\t%s > %s  (%.2f)\n' % (mod1, mod2, score)
+        yield '\n'
+    if diff['restored']:
+        yield 'Overlaps no longer discarded (winner > loser, score):\n\n'
+        for mod1, mod2, score in diff['restored']:
+            yield '\t%s > %s  (%.2f)\n' % (mod1, mod2, score)
+        yield '\n'
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Interactive HTML report of the overlaps.
+
+The page only loads a small index of the mods and of the edges with their
+scores. The overlapping files of the edges are written to chunk files,
+loaded when an edge is expanded. Data files are JSONP scripts rather than
+plain JSON documents, as browsers do not let a page opened from the disk
+fetch JSON files.
+"""
+
+import os
+import re
+import json
+
+__all__ = ["write_html_report"]
+
+# Maximum number of overlapping files per chunk file
+files_per_chunk = 20000
+
+
+def _text(name):
+    """ Decodes a file name, whatever its encoding. """
+    try:
+        return name.decode('utf-8')
+    except UnicodeDecodeError:
+        return name.decode('latin-1')
+
+
+def _jsonp(function, *args):
+    return '%s(%s);\n' % (function, ','.join(
+        json.dumps(arg, separators=(',', ':')) for arg in args))
+
+
+def write_html_report(graph, filename):
+    """ Writes the report 'filename'.html and its data files in the
+    directory 'filename'_html. """
+    data_dir = '%s_html' % filename
+    if not os.path.isdir(data_dir):
+        os.mkdir(data_dir)
+    for name in os.listdir(data_dir):
+        if re.match(r'(index|files_\d{5})\.js$', name):
+            os.remove(os.path.join(data_dir, name))
+
+    mods = sorted(graph.mod_nodes)
+    mod_ids = dict((mod, i) for i, mod in enumerate(mods))
+    edges = []
+    chunk = []
+    chunk_files = 0
+    chunk_count = 0
+
+    def write_chunk():
+        with open(os.path.join(data_dir, 'files_%05d.js' % chunk_count),
+                  'w') as stream:
+            stream.write(_jsonp('bioChunk', chunk_count, chunk))
+
+    for mod1, mod2, edge in graph.iter_edges():
+        if chunk and chunk_files + len(edge.datafiles) > files_per_chunk:
+            write_chunk()
+            chunk = []
+            chunk_files = 0
+            chunk_count += 1
+        edges.append([mod_ids[mod1], mod_ids[mod2],
+                      round(edge.norm_size_ratio, 2),
+                      round(edge.norm_mtime_ratio, 2),
+                      round(edge.norm_quality_ratio, 2),
+                      round(edge.norm_fc_ratio, 2), round(edge.score, 2),
+                      len(edge.datafiles),
+                      int(edge.removed) | (2 if edge.pruned else 0),
+                      chunk_count, len(chunk)])
+        chunk.append([[_text(datafile)] +
+                      list(edge.datafiles[datafile].sizes)
+                      for datafile in edge.get_datafiles()])
+        chunk_files += len(edge.datafiles)
+    if chunk:
+        write_chunk()
+
+    nodes = []
+    for mod in mods:
+        props = graph.mod_nodes[mod]
+        nodes.append([_text(mod), _text(graph.cfg.clean_mod_num_prefix(mod)),
+                      props.file_count,
+                      getattr(props, 'overlapped_count', 0) or 0,
+                      props.size,
+                      -1 if props.install_index is None
+                      else props.install_index])
+    with open(os.path.join(data_dir, 'index.js'), 'w') as stream:
+        stream.write(_jsonp('bioIndex', {
+            'quality': graph.cfg.quality_coeff > 0,
+            'mods': nodes,
+            'edges': edges}))
+
+    with open('%s.html' % filename, 'w') as stream:
+        stream.write(_page.replace('@DATA_DIR@', os.path.basename(data_dir)))
+
+
+_page = r'''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>BIO - Overlapping mods</title>
+<style>
+body { font-family: sans-serif; font-size: 14px; margin: 1em 2em; }
+table { border-collapse: collapse; }
+td, th { padding: 2px 8px; text-align: right; white-space: nowrap; }
+td.name, th.name { text-align: left; }
+tr.mod { cursor: pointer; border-top: 1px solid #ccc; }
+tr.mod:hover, tr.edge:hover { background: #eef; }
+tr.edge { cursor: pointer; color: #333; }
+tr.edge td.name { padding-left: 2em; }
+tr.removed { color: #b00; }
+tr.pruned { color: #999; }
+tr.file td { color: #666; font-size: 12px; }
+tr.file td.name { padding-left: 4em; }
+#filter { width: 30em; margin-bottom: 1em; }
+</style>
+</head>
+<body>
+<h1>Mod Install Precedence</h1>
+<p>Mods are listed in install order. Click a mod to see the mods it
+overwrites and the mods overwriting it, then an overlap to see its files.
+Discarded overlaps are shown in red.</p>
+<input id="filter" placeholder="Filter mods by name">
+<table id="mods"><thead><tr><th>#</th><th class="name">Mod</th>
+<th>Files</th><th>Overlapped</th><th>Size</th><th>Overwrites</th>
+<th>Overwritten by</th></tr></thead><tbody></tbody></table>
+<p id="more"></p>
+<script>
+var DATA_DIR = '@DATA_DIR@', PAGE = 500;
+var data, outgoing = [], incoming = [], chunks = {}, waiting = {};
+
+function cell(row, text, cls) {
+  var td = document.createElement('td');
+  td.textContent = text;
+  if (cls) td.className = cls;
+  row.appendChild(td);
+  return td;
+}
+
+function size(bytes) {
+  if (bytes < 1e3) return bytes + 'o';
+  if (bytes < 1e6) return Math.floor(bytes / 1e3) + 'K';
+  return Math.floor(bytes / 1e6) + 'M';
+}
+
+function bioIndex(index) {
+  data = index;
+  data.mods.forEach(function () { outgoing.push([]); incoming.push([]); });
+  data.edges.forEach(function (edge, i) {
+    outgoing[edge[0]].push(i);
+    incoming[edge[1]].push(i);
+  });
+  show('');
+}
+
+function bioChunk(n, lists) {
+  chunks[n] = lists;
+  (waiting[n] || []).forEach(function (callback) { callback(lists); });
+  delete waiting[n];
+}
+
+function loadChunk(n, callback) {
+  if (chunks[n]) return callback(chunks[n]);
+  if (!waiting[n]) {
+    waiting[n] = [];
+    var script = document.createElement('script');
+    script.src = DATA_DIR + '/files_' + ('0000' + n).slice(-5) + '.js';
+    document.head.appendChild(script);
+  }
+  waiting[n].push(callback);
+}
+
+function show(filter) {
+  var body = document.querySelector('#mods tbody');
+  body.innerHTML = '';
+  filter = filter.toLowerCase();
+  var order = data.mods.map(function (mod, i) { return i; })
+    .filter(function (i) {
+      return data.mods[i][0].toLowerCase().indexOf(filter) >= 0;
+    }).sort(function (a, b) {
+      var pa = data.mods[a][5], pb = data.mods[b][5];
+      return (pa < 0) - (pb < 0) || pa - pb;
+    });
+  var shown = 0;
+  function more() {
+    order.slice(shown, shown + PAGE).forEach(function (i) {
+      body.appendChild(modRow(i));
+    });
+    shown += PAGE;
+    var p = document.getElementById('more');
+    p.innerHTML = '';
+    if (shown < order.length) {
+      var a = document.createElement('a');
+      a.href = '#';
+      a.textContent = 'Show more (' + (order.length - shown) + ' left)';
+      a.onclick = function () { more(); return false; };
+      p.appendChild(a);
+    }
+  }
+  more();
+}
+
+function modRow(i) {
+  var mod = data.mods[i], row = document.createElement('tr');
+  row.className = 'mod';
+  cell(row, mod[5] < 0 ? '' : mod[5] + 1);
+  cell(row, mod[0], 'name');
+  cell(row, mod[2]);
+  cell(row, mod[3]);
+  cell(row, size(mod[4]));
+  cell(row, outgoing[i].length);
+  cell(row, incoming[i].length);
+  var rows = null;
+  row.onclick = function () {
+    if (rows) {
+      rows.forEach(function (r) {
+        if (r.parentNode) r.parentNode.removeChild(r);
+      });
+      rows = null;
+      return;
+    }
+    rows = [];
+    var after = row;
+    function add(r) {
+      after.parentNode.insertBefore(r, after.nextSibling);
+      after = r;
+      rows.push(r);
+    }
+    [['Overwrites', outgoing[i], 1], ['Overwritten by', incoming[i], 0]]
+      .forEach(function (group) {
+        if (!group[1].length) return;
+        var title = document.createElement('tr');
+        cell(title, '');
+        cell(title, group[0] + ' (NSR, NTR, ' + (data.quality ? 'NQR, ' : '') +
+             'FCR, Score, Files)', 'name');
+        add(title);
+        group[1].slice().sort(function (a, b) {
+          return data.edges[b][6] - data.edges[a][6];
+        }).forEach(function (e) { add(edgeRow(e, group[2], rows)); });
+      });
+  };
+  return row;
+}
+
+function edgeRow(e, other, rows) {
+  var edge = data.edges[e], row = document.createElement('tr');
+  row.className = 'edge' + (edge[8] & 1 ? ' removed' : '') +
+    (edge[8] & 2 ? ' pruned' : '');
+  cell(row, '');
+  cell(row, data.mods[edge[other]][1] + (edge[8] & 1 ? ' (discarded)' : '') +
+       (edge[8] & 2 ? ' (pruned)' : ''), 'name');
+  var values = [edge[2], edge[3]].concat(data.quality ? [edge[4]] : [])
+    .concat([edge[5], edge[6]]).map(function (v) { return v.toFixed(2); });
+  cell(row, values.join('  ') + '  ' + edge[7]).colSpan = 5;
+  var files = null;
+  row.onclick = function (event) {
+    event.stopPropagation();
+    if (files) {
+      files.forEach(function (r) { r.parentNode.removeChild(r); });
+      files = null;
+      return;
+    }
+    files = [];
+    loadChunk(edge[9], function (lists) {
+      var after = row;
+      lists[edge[10]].forEach(function (file) {
+        var r = document.createElement('tr');
+        r.className = 'file';
+        cell(r, '');
+        cell(r, file[0], 'name');
+        cell(r, size(file[1]) + ' / ' + size(file[2])).colSpan = 5;
+        after.parentNode.insertBefore(r, after.nextSibling);
+        after = r;
+        files.push(r);
+        rows.push(r);
+      });
+    });
+  };
+  return row;
+}
+
+var timer;
+document.getElementById('filter').oninput = function () {
+  var value = this.value;
+  clearTimeout(timer);
+  timer = setTimeout(function () { show(value); }, 200);
+};
+</script>
+<script src="@DATA_DIR@/index.js"></script>
+</body>
+</html>
+'''
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Scheduling of the reads of many files spread over several devices.
+Files are grouped by device: spinning disks and network shares are read
+by a few threads only, to avoid seek thrashing, while solid state
+devices are read by every thread. Among the next files to read, those
+of a device are read in inode order, which follows the directory layout
+on most file systems.
+"""
+
+import os
+import sys
+import heapq
+import itertools
+import threading
+
+__all__ = ["ModIOScheduler", "is_slow_device"]
+
+# File systems of network shares, read as slowly as spinning disks
+network_fs_types = set(['nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', '9p',
+                        'afs', 'ncpfs', 'fuse.sshfs', 'davfs', 'fuse.rclone'])
+# Bytes of the head and the tail of an archive hinted for read-ahead:
+# the listing of an archive is mostly read from these parts.
+readahead_size = 1 << 20
+POSIX_FADV_WILLNEED = 3
+
+# os.posix_fadvise is part of the standard library since Python 3.3,
+# the C library being called directly before, on Linux only.
+posix_fadvise = getattr(os, 'posix_fadvise', None)
+if posix_fadvise is None and sys.platform.startswith('linux'):
+    try:
+        import ctypes
+        import ctypes.util
+        _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        _libc.posix_fadvise64.argtypes = [ctypes.c_int, ctypes.c_int64,
+                                          ctypes.c_int64, ctypes.c_int]
+
+        def posix_fadvise(fd, offset, length, advice):
+            _libc.posix_fadvise64(fd, offset, length, advice)
+    except (ImportError, OSError, AttributeError, TypeError):
+        posix_fadvise = None
+
+
+def _mount_fs_type(path):
+    """ Returns the file system type of the mount point containing
+    'path', or None if unknown. """
+    path = os.path.realpath(path)
+    fs_type = None
+    mount_len = -1
+    try:
+        with open('/proc/self/mounts') as stream:
+            for line in stream:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1].replace('\\040', ' ')
+                if ((path == mount or path.startswith(mount.rstrip('/') + '/'))
+                        and len(mount) > mount_len):
+                    fs_type = fields[2]
+                    mount_len = len(mount)
+    except IOError:
+        return None
+    return fs_type
+
+
+def _is_rotational(dev):
+    """ Tells whether the block device 'dev' is a spinning disk, or None
+    if unknown. Partitions inherit the property of their disk. """
+    base = '/sys/dev/block/%d:%d' % (os.major(dev), os.minor(dev))
+    for path in (os.path.join(base, 'queue', 'rotational'),
+                 os.path.join(base, '..', 'queue', 'rotational')):
+        try:
+            with open(path) as stream:
+                return stream.read().strip() == '1'
+        except IOError:
+            pass
+    return None
+
+
+def is_slow_device(dev, path):
+    """ Tells whether the device 'dev' of the file 'path' is a spinning
+    disk or a network share. Devices are considered fast when it cannot
+    be told, eg. on Windows. """
+    if not sys.platform.startswith('linux'):
+        return False
+    if _mount_fs_type(path) in network_fs_types:
+        return True
+    return bool(_is_rotational(dev))
+
+
+def hint_readahead(path):
+    """ Asks the kernel to read the head and the tail of a file ahead. """
+    if posix_fadvise is None:
+        return
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        size = os.fstat(fd).st_size
+        posix_fadvise(fd, 0, min(size, readahead_size), POSIX_FADV_WILLNEED)
+        if size > readahead_size:
+            posix_fadvise(fd, max(readahead_size, size - readahead_size),
+                          readahead_size, POSIX_FADV_WILLNEED)
+    except (OSError, IOError):
+        pass
+    finally:
+        os.close(fd)
+
+
+class ModIOScheduler(object):
+    """ Applies a function reading a file to many items, at most 'jobs' at
+    once overall and 'slow_jobs' at once on each slow device (0 meaning
+    no limit), hinting the kernel to read ahead the next file of a slow
+    device if 'readahead' is set. At most 'window' items are scheduled or
+    held once read, ahead of the item whose result is expected. """
+
+    def __init__(self, jobs, slow_jobs=1, readahead=True, window=256):
+        self.jobs = jobs
+        self.slow_jobs = slow_jobs or jobs
+        self.readahead = readahead
+        self.window = max(window, jobs)
+        # device -> [is slow, number of files]
+        self.devices = {}
+
+    def locate(self, filename):
+        """ Returns the (device, inode) of a file, or (None, None) if it
+        cannot be told, counting the file in the statistics of its
+        device. """
+        if filename is None:
+            return None, None
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None, None
+        if st.st_dev not in self.devices:
+            self.devices[st.st_dev] = [is_slow_device(st.st_dev, filename), 0]
+        self.devices[st.st_dev][1] += 1
+        return st.st_dev, st.st_ino
+
+    def imap(self, fun, items, path=lambda item: item):
+        """ Yields fun(item) for each item, in the order of the items,
+        'path' giving the file read by fun for an item, or None. The items
+        are taken from their iterable as the window moves forward, the
+        items without file being grouped under the None device. """
+        items = iter(items)
+        results = {}
+        done = threading.Condition()
+        # Limits the overall number of running tasks
+        slots = threading.Semaphore(self.jobs)
+        # device -> heap of the (inode, index, item) to read
+        queues = {}
+        # device -> number of running threads
+        running = {}
+        stopped = []
+
+        def work(dev, slow):
+            while not stopped:
+                with done:
+                    tasks = queues[dev]
+                    if not tasks:
+                        running[dev] -= 1
+                        return
+                    ino, i, item = heapq.heappop(tasks)
+                    next_task = tasks[0] if tasks else None
+                if slow and self.readahead and next_task is not None:
+                    hint_readahead(path(next_task[2]))
+                with slots:
+                    try:
+                        result = (True, fun(item))
+                    except BaseException:
+                        result = (False, sys.exc_info())
+                with done:
+                    results[i] = result
+                    done.notify()
+
+        def schedule(i, item):
+            dev, ino = self.locate(path(item))
+            slow = dev is not None and self.devices[dev][0]
+            with done:
+                heapq.heappush(queues.setdefault(dev, []), (ino, i, item))
+                if running.get(dev, 0) >= (self.slow_jobs if slow
+                                           else self.jobs):
+                    return
+                running[dev] = running.get(dev, 0) + 1
+            thread = threading.Thread(target=work, args=(dev, slow))
+            thread.daemon = True
+            thread.start()
+
+        count = 0
+        exhausted = False
+        try:
+            for i in itertools.count():
+                while not exhausted and count - i < self.window:
+                    try:
+                        item = next(items)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    schedule(count, item)
+                    count += 1
+                if i == count:
+                    break
+                with done:
+                    while i not in results:
+                        done.wait(1)
+                    ok, result = results.pop(i)
+                if not ok:
+                    raise result[0], result[1], result[2]
+                yield result
+        finally:
+            # Stops the remaining tasks if the consumer gives up
+            stopped.append(True)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Progress of the long stages of an analysis: the listing of the archives,
+the expansion of the overlapping files into pairs of mods, and the breaking
+of precedence cycles.
+
+Updates only count; a report is made at most once per interval, on the
+console (on a single refreshed line) and optionally as JSON lines in a
+file, so that following progress costs next to nothing.
+"""
+
+import sys
+import json
+import time
+import multiprocessing
+
+__all__ = ["ModProgress"]
+
+
+def _duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60,
+                                 seconds % 60)
+    return '%d:%02d' % (seconds // 60, seconds % 60)
+
+
+class ModProgress(object):
+    """ Progress of the current stage. """
+
+    def __init__(self, console=True, json_file=None, interval=1.0):
+        # Pool worker processes would mix their lines on the console
+        self.console = (console and sys.stdout.isatty() and
+                        not multiprocessing.current_process().daemon)
+        self.json_stream = open(json_file, 'a') if json_file else None
+        self.enabled = self.console or self.json_stream is not None
+        self.interval = interval
+        self.stage = None
+        self.line_width = 0
+
+    def start(self, stage, unit, total=None):
+        """ Starts a stage processing 'total' items named 'unit', total
+        being None if unknown yet. """
+        self.stage = stage
+        self.unit = unit
+        self.total = total
+        # Whether the total is still growing, eg. during the discovery
+        self.total_final = total is not None
+        self.done = 0
+        self.counters = {}
+        self.tstart = self.last = time.time()
+
+    def add_total(self, count):
+        """ Adds items to process to a total which is not known yet. """
+        self.total = (self.total or 0) + count
+
+    def end_total(self):
+        self.total_final = True
+
+    def update(self, done=1, **counters):
+        """ Counts 'done' more processed items and adds the values of the
+        named counters, eg. entries=120. """
+        self.done += done
+        for name, value in counters.iteritems():
+            self.counters[name] = self.counters.get(name, 0) + value
+        if self.enabled:
+            now = time.time()
+            if now - self.last >= self.interval:
+                self.last = now
+                self.report(now)
+
+    def get_state(self, now):
+        elapsed = max(now - self.tstart, 1e-6)
+        state = {'stage': self.stage, 'unit': self.unit, 'done': self.done,
+                 'total': self.total, 'elapsed': round(elapsed, 2),
+                 'rate': round(self.done / elapsed, 2)}
+        for name, value in self.counters.iteritems():
+            state[name] = value
+            state[name + '_rate'] = round(value / elapsed, 2)
+        if self.total and self.done:
+            state['eta'] = round((self.total - self.done) * elapsed /
+                                 self.done, 1)
+        return state
+
+    def format_state(self, state):
+        line = '  %s: %d' % (state['stage'], state['done'])
+        if state['total'] is not None:
+            line += '/%d%s' % (state['total'],
+                               '' if self.total_final else '+')
+        line += ' %s (%.1f/s)' % (state['unit'], state['rate'])
+        for name in sorted(self.counters):
+            if name == 'bytes':
+                line += ', %.1f MB parsed (%.1f MB/s)' % (
+                        state[name] / 2.0**20, state[name + '_rate'] / 2.0**20)
+            else:
+                line += ', %d %s (%.0f/s)' % (state[name], name,
+                                              state[name + '_rate'])
+        if 'eta' in state and self.total_final:
+            line += ', ETA %s' % _duration(state['eta'])
+        return line
+
+    def report(self, now):
+        state = self.get_state(now)
+        if self.json_stream is not None:
+            state['time'] = round(now, 2)
+            self.json_stream.write(json.dumps(state, sort_keys=True) + '\n')
+            self.json_stream.flush()
+        if self.console:
+            line = self.format_state(state)
+            sys.stdout.write('\r%s%s' % (
+                line, ' ' * max(0, self.line_width - len(line))))
+            sys.stdout.flush()
+            self.line_width = len(line)
+
+    def finish(self):
+        """ Ends the stage. Its final state is reported if any report has
+        been made during it. """
+        if self.stage is None:
+            return
+        if self.last != self.tstart:
+            self.report(time.time())
+            if self.console:
+                sys.stdout.write('\n')
+                self.line_width = 0
+        self.stage = None
+
+    def close(self):
+        self.finish()
+        if self.json_stream is not None:
+            self.json_stream.close()
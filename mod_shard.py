@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Partial indexes of a mod library, written by BIO processes listing a
+subset (shard) of the archives, then merged by another BIO process.
+
+An index file is a gzip compressed JSON document per line: a header,
+then one record per mod, data file or plugin master list. Paths are
+stored with '/' separators, and byte strings as latin-1 decoded strings,
+so that files can be exchanged between hosts and platforms.
+"""
+
+import os
+import gzip
+import json
+import zlib
+import heapq
+
+__all__ = ["ModIndexError", "ModIndexWriter", "read_index", "read_indexes",
+           "shard_of"]
+
+index_format = 'bio-index'
+index_version = 1
+
+
+class ModIndexError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+
+def shard_of(mod, count):
+    """ Returns the shard (0 <= shard < count) a mod belongs to,
+    from a hash of its name. """
+    return (zlib.crc32(mod.replace(os.sep, '/')) & 0xffffffff) % count
+
+
+def _to_json(value):
+    if isinstance(value, str):
+        return value.replace(os.sep, '/').decode('latin-1')
+    return value
+
+
+def _from_json(value):
+    if isinstance(value, unicode):
+        return value.encode('latin-1').replace('/', os.sep)
+    return value
+
+
+class ModIndexWriter(object):
+    """ Writes the partial index of the mods listed by a BIO process. """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.stream = gzip.open(filename, 'wb')
+        self.write('header', index_format, index_version)
+
+    def write(self, kind, *values):
+        self.stream.write(json.dumps([kind] + [
+            [_to_json(v) for v in value] if isinstance(value, list)
+            else _to_json(value) for value in values]))
+        self.stream.write('\n')
+
+    def add_mod(self, mod, file_count, size):
+        self.write('mod', mod, file_count, size)
+
+    def add_file(self, datafile, size, mtime, fhash, mod, arcpath):
+        self.write('file', datafile, size, mtime, fhash, mod, arcpath)
+
+    def add_masters(self, fhash, masters):
+        """ Master list of the plugin whose CRC is 'fhash'. """
+        self.write('masters', fhash, masters)
+
+    def close(self):
+        self.stream.close()
+
+
+def read_index(filename):
+    """ Yields the (kind, values) records of an index file, kind being
+    'mod', 'file' or 'masters'. """
+    try:
+        stream = gzip.open(filename, 'rb')
+        header = json.loads(stream.readline())
+    except (IOError, ValueError):
+        raise ModIndexError("'%s' is not a BIO index file." % filename)
+    if header != ['header', index_format, index_version]:
+        raise ModIndexError("'%s' has been written by an incompatible "\
+                "version of BIO." % filename)
+    with stream:
+        for line in stream:
+            record = json.loads(line)
+            yield record[0], [
+                [_from_json(v) for v in value] if isinstance(value, list)
+                else _from_json(value) for value in record[1:]]
+
+
+def _iter_mod_records(filename, i, mod_key):
+    """ Yields the records of an index file grouped by mod, each group
+    ending with the 'mod' record written after the files of the mod, and
+    the plugin master lists last, as (sort key, records) pairs. """
+    records = []
+    for kind, values in read_index(filename):
+        records.append((kind, values))
+        if kind == 'mod':
+            yield (0, mod_key(values[0]), i), records
+            records = []
+    if records:
+        yield (1, i), records
+
+
+def read_indexes(filenames, mod_key):
+    """ Yields the (kind, values) records of several index files, the
+    mods of all of them being sorted by 'mod_key'. Each index must list its
+    mods in that order, as BIO processes discovering the same library do,
+    so that the merged records follow the order of a single process. """
+    for key, records in heapq.merge(*[
+            _iter_mod_records(filename, i, mod_key)
+            for i, filename in enumerate(filenames)]):
+        for record in records:
+            yield record
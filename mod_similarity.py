@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Detection of near-duplicate mod archives, such as several releases of
+a same mod kept in the library.
+
+Each mod is summarized while it is listed by a MinHash signature of the
+set of its (path, CRC) pairs, computed in a single pass by one permutation
+hashing. Similar mods are then found by locality sensitive hashing: the
+signatures are cut into bands, and only the mods sharing a band are
+compared, instead of every pair of mods.
+"""
+
+import struct
+import hashlib
+
+__all__ = ["ModSimilarity"]
+
+
+class ModSimilarity(object):
+    """ MinHash signatures of the listed mods. """
+
+    # Number of bins of a signature
+    signature_size = 128
+    # Pairs of similarity s share one of the b LSH bands of r bins with
+    # probability 1 - (1 - s^r)^b. The bands are made as wide as possible
+    # while the pairs of the threshold similarity still share one with at
+    # least this probability, so that few dissimilar pairs are compared:
+    # for the default threshold 0.8, r = 8 and b = 16, ie. 0.95 for
+    # s = 0.8 and 0.01 for s = 0.4.
+    min_recall = 0.9
+    # Mods having fewer files are not compared
+    min_files = 5
+
+    def __init__(self, threshold):
+        """ threshold: minimum estimated Jaccard similarity of the file
+        sets of two mods for them to be near-duplicates. """
+        self.threshold = threshold
+        # Number of bins per LSH band, dividing the signature size
+        self.band_size = 1
+        for band_size in (16, 8, 4, 2):
+            if 1 - (1 - threshold ** band_size) ** (
+                    self.signature_size // band_size) >= self.min_recall:
+                self.band_size = band_size
+                break
+        # mod -> [minimum hash of each bin, file count, newest mtime],
+        # for the mods being listed.
+        self.pending = {}
+        # mod -> (signature, file count, newest mtime)
+        self.signatures = {}
+
+    def add_file(self, mod, datafile, fhash, mtime):
+        entry = self.pending.get(mod)
+        if entry is None:
+            entry = self.pending[mod] = [[None] * self.signature_size, 0,
+                                         mtime]
+        value = struct.unpack_from('<Q', hashlib.md5(
+            '%s\0%s' % (datafile, fhash)).digest())[0]
+        value, index = divmod(value, self.signature_size)
+        mins = entry[0]
+        if mins[index] is None or value < mins[index]:
+            mins[index] = value
+        entry[1] += 1
+        if mtime > entry[2]:
+            entry[2] = mtime
+
+    def add_mod(self, mod):
+        """ Computes the signature of a mod once all its files are added.
+        Empty bins take the value of the next filled bin, shifted by their
+        distance to it (rotation densification), so that two signatures
+        only match on bins really filled by the same files. """
+        if mod not in self.pending:
+            return
+        mins, count, newest = self.pending.pop(mod)
+        if count < self.min_files:
+            return
+        size = self.signature_size
+        signature = list(mins)
+        for i in range(size):
+            if signature[i] is None:
+                for distance in range(1, size):
+                    value = mins[(i + distance) % size]
+                    if value is not None:
+                        signature[i] = (value, distance)
+                        break
+        self.signatures[mod] = (tuple(signature), count, newest)
+
+    def similar_pairs(self):
+        """ Yields the (mod1, mod2, estimated similarity) of the pairs of
+        near-duplicate mods. """
+        buckets = {}
+        for mod, (signature, _, _) in self.signatures.iteritems():
+            for start in range(0, self.signature_size, self.band_size):
+                buckets.setdefault(
+                        (start, signature[start:start + self.band_size]),
+                        []).append(mod)
+        compared = set()
+        for mods in buckets.itervalues():
+            if len(mods) < 2:
+                continue
+            mods.sort()
+            for i, mod1 in enumerate(mods):
+                for mod2 in mods[i + 1:]:
+                    if (mod1, mod2) in compared:
+                        continue
+                    compared.add((mod1, mod2))
+                    similarity = self.similarity(mod1, mod2)
+                    if similarity >= self.threshold:
+                        yield mod1, mod2, similarity
+
+    def similarity(self, mod1, mod2):
+        """ Estimated Jaccard similarity of the file sets of two mods. """
+        sig1 = self.signatures[mod1][0]
+        sig2 = self.signatures[mod2][0]
+        return (float(sum(1 for v1, v2 in zip(sig1, sig2) if v1 == v2)) /
+                self.signature_size)
+
+    def superseded(self):
+        """ Returns the near-duplicate mods whose newest file is older than
+        the newest file of their duplicate, as a dictionary:
+        superseded mod -> (superseding mod, similarity), and the list of
+        the (mod1, mod2, similarity) of the other near-duplicates. """
+        superseded = {}
+        duplicates = []
+        for mod1, mod2, similarity in self.similar_pairs():
+            newest1 = self.signatures[mod1][2]
+            newest2 = self.signatures[mod2][2]
+            if newest1 == newest2:
+                duplicates.append((mod1, mod2, similarity))
+                continue
+            old, new = (mod1, mod2) if newest1 < newest2 else (mod2, mod1)
+            if old not in superseded or similarity > superseded[old][1]:
+                superseded[old] = (new, similarity)
+        return superseded, sorted(duplicates)
+
+    def newest_mtime(self, mod):
+        return self.signatures[mod][2]
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Binary snapshot of a finished analysis: the graph of the overlapping
+mods, with the normalized ratios and scores of its edges and the files of
+each overlap, and the install order.
+
+The snapshot is memory-mapped when loaded, so that reports can be written
+again, graphs rendered again and queries answered without listing the
+archives nor scoring the mods again. All integers and floats are little
+endian. The file is made of a header, then of the sections:
+- strings: offsets (n + 1 uint64) and bytes of the mod and file names,
+- nodes: name, file count, overlapped file count, size, install index,
+  and range of the outgoing edges of each mod, sorted by name,
+- edges: mods, flags, normalized ratios, score and range of the overlapping
+  files of each edge, sorted by first mod,
+- files: name, sizes, times and texture qualities of the overlapping files
+  of the edges, sorted by name within an edge,
+- order: the mods of the install order,
+- datafiles: every overlapping file name, sorted, with the range of its
+  (edge, file) references in the following section,
+- references: the (edge, file) of the overlaps of each data file.
+"""
+
+import os
+import re
+import mmap
+import struct
+
+from mod_graph import ModGraph, _ModEdge, _ModProps, _FileProps
+
+__all__ = ["ModSnapshotError", "ModSnapshot", "write_snapshot", "iter_query"]
+
+snapshot_magic = 'BIOSNAP\0'
+snapshot_version = 1
+
+_header = struct.Struct('<8sI7I8Q')
+_offset = struct.Struct('<Q')
+_node = struct.Struct('<IIIQiII')
+_edge = struct.Struct('<IIIdddddII')
+_file = struct.Struct('<IQQiidd')
+_index = struct.Struct('<I')
+_datafile = struct.Struct('<III')
+_reference = struct.Struct('<II')
+
+# Edge flags
+REMOVED = 1
+FORCED = 2
+PRUNED = 4
+
+
+class ModSnapshotError(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+
+def write_snapshot(filename, graph, order):
+    """ Saves the graph, once ordered, and the install order 'order'. """
+    strings = []
+    string_ids = {}
+
+    def string_id(string):
+        if string not in string_ids:
+            string_ids[string] = len(strings)
+            strings.append(string)
+        return string_ids[string]
+
+    mods = sorted(graph.mod_nodes)
+    mod_ids = dict((mod, i) for i, mod in enumerate(mods))
+    nodes = []
+    edges = []
+    files = []
+    references = {}
+    for mod1 in mods:
+        props = graph.mod_nodes[mod1]
+        first_edge = len(edges)
+        for mod2 in sorted(graph.mod_edges.get(mod1, {})):
+            edge = graph.mod_edges[mod1][mod2]
+            flags = ((REMOVED if edge.removed else 0) |
+                     (PRUNED if edge.pruned else 0) |
+                     (FORCED if graph.cfg.is_greater(mod1, mod2) == 1
+                      else 0))
+            first_file = len(files)
+            for datafile in sorted(edge.datafiles):
+                file_props = edge.datafiles[datafile]
+                qualities = file_props.qualities or (float('nan'),) * 2
+                references.setdefault(datafile, []).append(
+                        (len(edges), len(files)))
+                files.append(_file.pack(
+                    string_id(datafile), file_props.sizes[0],
+                    file_props.sizes[1], file_props.mtimes[0],
+                    file_props.mtimes[1], qualities[0], qualities[1]))
+            edges.append(_edge.pack(
+                mod_ids[mod1], mod_ids[mod2], flags, edge.norm_size_ratio,
+                edge.norm_mtime_ratio, edge.norm_fc_ratio,
+                edge.norm_quality_ratio, edge.score, first_file,
+                len(files) - first_file))
+        install_index = props.install_index
+        nodes.append(_node.pack(
+            string_id(mod1), props.file_count,
+            getattr(props, 'overlapped_count', 0) or 0, props.size,
+            -1 if install_index is None else install_index,
+            first_edge, len(edges) - first_edge))
+
+    datafiles = []
+    refs = []
+    for datafile in sorted(references):
+        datafiles.append(_datafile.pack(string_id(datafile), len(refs),
+                                        len(references[datafile])))
+        refs.extend(_reference.pack(*ref) for ref in references[datafile])
+
+    offsets = []
+    position = 0
+    for string in strings:
+        offsets.append(_offset.pack(position))
+        position += len(string)
+    offsets.append(_offset.pack(position))
+
+    sections = [''.join(offsets), ''.join(strings), ''.join(nodes),
+                ''.join(edges), ''.join(files),
+                ''.join(_index.pack(mod_ids[mod]) for mod in order),
+                ''.join(datafiles), ''.join(refs)]
+    section_offsets = []
+    position = _header.size
+    for section in sections:
+        section_offsets.append(position)
+        position += len(section)
+    header = _header.pack(snapshot_magic, snapshot_version, len(strings),
+                          len(nodes), len(edges), len(files), len(order),
+                          len(datafiles), len(refs), *section_offsets)
+    tmp_filename = '%s.tmp' % filename
+    with open(tmp_filename, 'wb') as stream:
+        stream.write(header)
+        for section in sections:
+            stream.write(section)
+    if os.path.exists(filename):
+        os.remove(filename)
+    os.rename(tmp_filename, filename)
+
+
+class ModSnapshot(object):
+    """ Memory-mapped snapshot of an analysis. Records are only decoded
+    when accessed. """
+
+    def __init__(self, filename):
+        try:
+            with open(filename, 'rb') as stream:
+                self.data = mmap.mmap(stream.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+        except (IOError, ValueError, mmap.error):
+            raise ModSnapshotError("Cannot read the snapshot '%s'." %
+                                   filename)
+        if (len(self.data) < _header.size or
+                self.data[:len(snapshot_magic)] != snapshot_magic):
+            raise ModSnapshotError("'%s' is not a BIO snapshot." % filename)
+        header = _header.unpack_from(self.data)
+        if header[1] != snapshot_version:
+            raise ModSnapshotError("'%s' has been written by an "\
+                    "incompatible version of BIO." % filename)
+        (self.string_count, self.node_count, self.edge_count,
+         self.file_count, self.order_count, self.datafile_count,
+         self.reference_count) = header[2:9]
+        (self.strings_offset, self.string_data_offset, self.nodes_offset,
+         self.edges_offset, self.files_offset, self.order_offset,
+         self.datafiles_offset, self.references_offset) = header[9:]
+        self.mod_ids = None
+
+    def close(self):
+        self.data.close()
+
+    def string(self, i):
+        start, end = struct.unpack_from(
+                '<2Q', self.data, self.strings_offset + i * _offset.size)
+        return self.data[self.string_data_offset + start:
+                         self.string_data_offset + end]
+
+    def node(self, i):
+        """ Returns (name, file count, overlapped count, size, install
+        index, first edge, edge count) of the mod 'i'. """
+        node = _node.unpack_from(self.data, self.nodes_offset + i * _node.size)
+        return (self.string(node[0]),) + node[1:]
+
+    def mod_name(self, i):
+        return self.string(_node.unpack_from(
+            self.data, self.nodes_offset + i * _node.size)[0])
+
+    def edge(self, i):
+        """ Returns (mod1, mod2, flags, size ratio, mtime ratio, file count
+        ratio, quality ratio, score, first file, file count) of the edge
+        'i', mods being given by their number. """
+        return _edge.unpack_from(self.data, self.edges_offset + i * _edge.size)
+
+    def file(self, i):
+        """ Returns (name, sizes, mtimes, qualities) of the file 'i'. """
+        record = _file.unpack_from(self.data,
+                                   self.files_offset + i * _file.size)
+        qualities = record[5:7]
+        return (self.string(record[0]), record[1:3], record[3:5],
+                None if qualities[0] != qualities[0] else qualities)
+
+    def order(self):
+        return [self.mod_name(_index.unpack_from(
+            self.data, self.order_offset + i * _index.size)[0])
+            for i in range(self.order_count)]
+
+    def find_mod(self, name):
+        """ Returns the number of a mod from its name, with or without its
+        directory and numerical prefix, or None. """
+        if self.mod_ids is None:
+            self.mod_ids = {}
+            for i in range(self.node_count):
+                mod = self.mod_name(i)
+                self.mod_ids[mod.lower()] = i
+                base = os.path.basename(mod).lower()
+                self.mod_ids.setdefault(base, i)
+                self.mod_ids.setdefault(re.sub("^\d+[ -_]", "", base), i)
+        return self.mod_ids.get(name.replace('/', os.sep).lower())
+
+    def mod_edges(self, i):
+        """ Yields the outgoing edges of the mod 'i'. """
+        node = self.node(i)
+        for j in range(node[5], node[5] + node[6]):
+            yield self.edge(j)
+
+    def incoming_edges(self, i):
+        """ Yields the incoming edges of the mod 'i'. """
+        for j in range(self.edge_count):
+            edge = self.edge(j)
+            if edge[1] == i:
+                yield edge
+
+    def datafile_name(self, i):
+        return self.string(_datafile.unpack_from(
+            self.data, self.datafiles_offset + i * _datafile.size)[0])
+
+    def find_datafile(self, name):
+        """ Returns the list of the (edge, file) of the overlaps of a data
+        file, found by binary search. """
+        name = name.replace('/', os.sep).lower()
+        low, high = 0, self.datafile_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.datafile_name(middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+        i = low
+        if i == self.datafile_count or self.datafile_name(i) != name:
+            return []
+        _, first, count = _datafile.unpack_from(
+                self.data, self.datafiles_offset + i * _datafile.size)
+        return [_reference.unpack_from(
+            self.data, self.references_offset + j * _reference.size)
+            for j in range(first, first + count)]
+
+    def to_graph(self, cfg):
+        """ Rebuilds the ModGraph of the analysis, the forced precedences
+        (eg. from plugin masters) being added to the configuration. """
+        graph = ModGraph(cfg)
+        mods = []
+        for i in range(self.node_count):
+            (mod, file_count, overlapped_count, size, install_index, _,
+             _) = self.node(i)
+            props = _ModProps(file_count, size)
+            props.set_overlapped_count(overlapped_count)
+            props.install_index = (None if install_index < 0
+                                   else install_index)
+            graph.mod_nodes[mod] = props
+            mods.append(mod)
+        graph.FAS = []
+        for i in range(self.edge_count):
+            (mod1, mod2, flags, size_ratio, mtime_ratio, fc_ratio,
+             quality_ratio, score, first_file, file_count) = self.edge(i)
+            mod1 = mods[mod1]
+            mod2 = mods[mod2]
+            edge = _ModEdge()
+            edge.norm_size_ratio = size_ratio
+            edge.norm_mtime_ratio = mtime_ratio
+            edge.norm_fc_ratio = fc_ratio
+            edge.norm_quality_ratio = quality_ratio
+            edge.score = score
+            edge.removed = bool(flags & REMOVED)
+            edge.pruned = bool(flags & PRUNED)
+            for j in range(first_file, first_file + file_count):
+                datafile, sizes, mtimes, qualities = self.file(j)
+                file_props = _FileProps.__new__(_FileProps)
+                file_props.sizes = sizes
+                file_props.mtimes = mtimes
+                file_props.qualities = qualities
+                edge.datafiles[datafile] = file_props
+            graph.add_edge(mod1, mod2, edge)
+            if edge.removed:
+                graph.FAS.append((mod1, mod2, edge))
+            elif edge.pruned:
+                graph.pruned.append((mod1, mod2, edge))
+            if flags & FORCED and cfg.is_greater(mod1, mod2) == 0:
+                cfg.add_precedence(mod1, mod2)
+        return graph
+
+
+def iter_query(snapshot, name, clean_name=lambda mod: mod):
+    """ Generates the description of the overlaps of a mod or of a data
+    file of a snapshot. """
+    i = snapshot.find_mod(name)
+    if i is not None:
+        (mod, file_count, overlapped_count, size, install_index, _,
+         _) = snapshot.node(i)
+        yield '%s\n' % mod
+        if install_index >= 0:
+            yield '\tInstall position: %d of %d\n' % (install_index + 1,
+                                                      snapshot.order_count)
+        yield '\tFiles: %d, overlapped by other mods: %d, size: %d\n' % (
+                file_count, overlapped_count, size)
+        for title, edges, other in (
+                ('Overrides', snapshot.mod_edges(i), 1),
+                ('Overridden by', snapshot.incoming_edges(i), 0)):
+            edges = sorted(edges, key=lambda edge: -edge[7])
+            yield '\t%s %d mods:\n' % (title, len(edges))
+            for edge in edges:
+                yield '\t\t%s  (score %.2f, %d files%s%s%s)\n' % (
+                        clean_name(snapshot.mod_name(edge[other])), edge[7],
+                        edge[9], ', forced' if edge[2] & FORCED else '',
+                        ', discarded' if edge[2] & REMOVED else '',
+                        ', pruned' if edge[2] & PRUNED else '')
+        return
+
+    references = snapshot.find_datafile(name)
+    if not references:
+        yield "No mod nor overlapping data file named '%s'.\n" % name
+        return
+    yield '%s\n' % name
+    for edge_id, file_id in references:
+        edge = snapshot.edge(edge_id)
+        datafile, sizes, mtimes, qualities = snapshot.file(file_id)
+        yield '\t%s > %s  (sizes %d / %d%s)\n' % (
+                clean_name(snapshot.mod_name(edge[0])),
+                clean_name(snapshot.mod_name(edge[1])), sizes[0], sizes[1],
+                ', discarded' if edge[2] & REMOVED else
+                ', pruned' if edge[2] & PRUNED else '')
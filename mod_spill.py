@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import heapq
+import shutil
+import marshal
+import tempfile
+from itertools import groupby
+
+__all__ = ["ModSpill"]
+
+
+class ModSpill(object):
+    """ External memory index of the data files, used instead of the
+    in-memory dictionary for libraries too large to fit in memory.
+
+    Data file records are buffered, then written as sorted runs to
+    temporary files whenever the buffer reaches its memory ceiling.
+    The runs are finally merged to group the versions of each data file.
+    """
+
+    # Rough memory footprint of a buffered record, in bytes
+    record_size = 400
+    # Records written per marshal chunk in a run file
+    chunk_size = 4096
+    # Maximum number of run files merged at once
+    max_merged_runs = 64
+
+    def __init__(self, memory_limit, tmp_dir=None):
+        """ memory_limit: memory ceiling of the buffer, in MB. """
+        self.max_records = max(self.chunk_size,
+                               memory_limit * 2**20 // self.record_size)
+        self.tmp_dir = tempfile.mkdtemp(prefix='bio-spill-', dir=tmp_dir)
+        self.buffer = []
+        self.runs = []
+        self.run_count = 0
+        # Insertion sequence number, so that the first version of
+        # a data file added for a given hash is kept, as in memory.
+        self.seq = 0
+
+    def add(self, datafile, fhash, mod, size, mtime, arcpath):
+        self.buffer.append((datafile, self.seq, fhash, mod, size, mtime,
+                            arcpath))
+        self.seq += 1
+        if len(self.buffer) >= self.max_records:
+            self.flush()
+
+    def flush(self):
+        """ Writes the buffered records as a sorted run. """
+        if not self.buffer:
+            return
+        self.buffer.sort()
+        self.runs.append(self.write_run(self.buffer))
+        self.buffer = []
+
+    def write_run(self, records):
+        filename = os.path.join(self.tmp_dir, 'run%05d' % self.run_count)
+        self.run_count += 1
+        with open(filename, 'wb') as stream:
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) == self.chunk_size:
+                    marshal.dump(chunk, stream)
+                    chunk = []
+            if chunk:
+                marshal.dump(chunk, stream)
+        return filename
+
+    def read_run(self, filename):
+        with open(filename, 'rb') as stream:
+            while 1:
+                try:
+                    chunk = marshal.load(stream)
+                except EOFError:
+                    return
+                for record in chunk:
+                    yield tuple(record)
+
+    def merged_records(self):
+        """ Yields every record, sorted by data file then insertion order,
+        merging at most max_merged_runs run files at once. """
+        self.flush()
+        while len(self.runs) > self.max_merged_runs:
+            runs = self.runs[:self.max_merged_runs]
+            self.runs = self.runs[self.max_merged_runs:]
+            self.runs.append(self.write_run(
+                heapq.merge(*[self.read_run(run) for run in runs])))
+            for run in runs:
+                os.remove(run)
+        return heapq.merge(*[self.read_run(run) for run in self.runs])
+
+    def iter_overlapping(self, excluded_mods=()):
+        """ Yields (data file, versions) for the data files having more than
+        one version, versions being a dictionary:
+        hash -> (archive file name, size, mtime, path in the archive)
+        The records of the mods 'excluded_mods' are skipped. """
+        for datafile, records in groupby(self.merged_records(),
+                                         lambda record: record[0]):
+            versions = {}
+            for _, _, fhash, mod, size, mtime, arcpath in records:
+                if fhash not in versions and mod not in excluded_mods:
+                    versions[fhash] = (mod, size, mtime, arcpath)
+            if len(versions) > 1:
+                yield datafile, versions
+
+    def close(self):
+        """ Removes the run files. """
+        shutil.rmtree(self.tmp_dir, True)
+        self.runs = []
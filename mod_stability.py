@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 Mehdi Yousfi-Monod <mehdi.yousfi@gmail.com>
+#
+# This file is part of BIO (Morrowind Better Install Order).
+#
+#    BIO is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    BIO is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with BIO.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" Stability of the install order under small changes of the scores.
+
+The graph is scored, oriented, pruned, made acyclic and sorted again many
+times, its normalized criterion ratios and criterion coefficients being
+each multiplied by a random factor exp(N(0, sigma)), by a pool of
+processes.
+The pairs of mods keep F(mod1, mod2) = 1/F(mod2, mod1) as both edges of a
+pair are given inverse factors.
+"""
+
+import math
+import random
+import multiprocessing
+
+__all__ = ["perturbed_orders", "iter_stability_report"]
+
+# Graph and configuration of the worker processes
+_graph = None
+_coeffs = None
+
+
+def _init_worker(graph):
+    global _graph, _coeffs
+    _graph = graph
+    cfg = graph.cfg
+    # The perturbed runs are not logged
+    cfg.log_fd = None
+    _coeffs = (cfg.size_coeff, cfg.mtime_coeff, cfg.fc_coeff,
+               cfg.quality_coeff)
+
+
+def _perturbed_order(seed):
+    """ Returns the install order and the kept (winner, loser) overlaps of
+    a run with randomly perturbed scores. """
+    rng = random.Random(seed)
+    sigma = _graph.cfg.option['stability_sigma']
+
+    def factor():
+        return math.exp(rng.gauss(0.0, sigma))
+
+    graph = _graph.copy_ratios()
+    cfg = graph.cfg
+    (cfg.size_coeff, cfg.mtime_coeff, cfg.fc_coeff, cfg.quality_coeff) = [
+            coeff * factor() for coeff in _coeffs]
+    pair_factors = {}
+    for mod1 in sorted(graph.mod_edges):
+        for mod2 in sorted(graph.mod_edges[mod1]):
+            pair = (min(mod1, mod2), max(mod1, mod2))
+            if pair not in pair_factors:
+                pair_factors[pair] = [factor() for i in range(4)]
+            factors = pair_factors[pair]
+            if mod1 != pair[0]:
+                factors = [1.0 / f for f in factors]
+            edge = graph.mod_edges[mod1][mod2]
+            edge.norm_size_ratio *= factors[0]
+            edge.norm_mtime_ratio *= factors[1]
+            edge.norm_fc_ratio *= factors[2]
+            edge.norm_quality_ratio *= factors[3]
+
+    # Pruned as in the analysis, so that its pruned overlaps do not
+    # seem fragile for being broken as part of cycles here.
+    graph.set_directions()
+    graph.prune_edges()
+    graph.break_cycles()
+    order = graph.order_pruned()
+    return order, [(mod1, mod2) for mod1 in graph.mod_edges
+                   for mod2 in graph.mod_edges[mod1]]
+
+
+def perturbed_orders(graph, runs, jobs):
+    """ Returns the (install order, kept overlaps) of 'runs' runs with
+    perturbed scores, from a graph returned by ModGraph.copy_ratios(), by a
+    pool of 'jobs' processes. """
+    pool = multiprocessing.Pool(jobs, _init_worker, (graph,))
+    try:
+        return pool.map(_perturbed_order, range(runs))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def iter_stability_report(order, edges, results, sigma, name=lambda m: m):
+    """ Generates the stability report, from the current install 'order',
+    its kept (winner, loser, score) overlaps 'edges', and the results of
+    perturbed_orders. """
+    positions = dict((mod, []) for mod in order)
+    held = dict(((mod1, mod2), 0) for mod1, mod2, _ in edges)
+    for run_order, run_edges in results:
+        for i, mod in enumerate(run_order):
+            positions.setdefault(mod, []).append(i)
+        for edge in run_edges:
+            if edge in held:
+                held[edge] += 1
+
+    runs = len(results)
+    yield 'Install order stability over %d runs whose scores were ' \
+            'perturbed by a factor exp(N(0, %.2f)).\n\n' % (runs, sigma)
+
+    def spread(mod):
+        values = positions[mod]
+        mean = float(sum(values)) / len(values)
+        return (sum((v - mean) ** 2 for v in values) / len(values)) ** 0.5
+
+    yield 'Mod positions (current, lowest - highest, standard deviation):\n\n'
+    stats = sorted(((spread(mod), i, mod) for i, mod in enumerate(order)
+                    if positions[mod]), key=lambda stat: (-stat[0], stat[1]))
+    for deviation, i, mod in stats:
+        yield '\t%4d  %4d - %-4d  %6.2f  %s\n' % (
+                i + 1, min(positions[mod]) + 1, max(positions[mod]) + 1,
+                deviation, name(mod))
+
+    fragile = sorted(((held[(mod1, mod2)], -score, mod1, mod2)
+                      for mod1, mod2, score in edges
+                      if held[(mod1, mod2)] < runs))
+    yield '\nFragile overlaps (winner > loser, score, runs where it held):\n\n'
+    if not fragile:
+        yield '\tNone\n'
+    for count, score, mod1, mod2 in fragile:
+        yield '\t%s > %s  (%.2f, %d%%)\n' % (name(mod1), name(mod2), -score,
+                                             100 * count // runs)